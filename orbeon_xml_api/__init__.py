@@ -2,5 +2,7 @@
 # Copyright 2017-2018 Bob Leers (http://www.novacode.nl)
 # See LICENSE file for full licensing details.
 
+__version__ = '0.1.0.dev28'
+
 # from . import tests
 from . import builder
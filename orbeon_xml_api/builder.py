@@ -2,14 +2,20 @@
 # Copyright 2017-2018 Bob Leers (http://www.novacode.nl)
 # See LICENSE file for full licensing details.
 
+from collections import Mapping, MutableMapping, OrderedDict
 from lxml import etree
 
-import xmltodict
+import copy
+import threading
 
 from controls import StringControl, DateControl, TimeControl, DateTimeControl, \
     BooleanControl, AnyUriControl, EmailControl, DecimalControl, \
     Select1Control, OpenSelect1Control, SelectControl, ImageAnnotationControl
-from utils import generate_xml_root, unaccent_unicode
+from utils import etree_to_xmltodict, generate_content_key, generate_xml_root, get_element_root, \
+    is_element, parse_xml_file, unaccent_unicode, PARSE_STRICT_THEN_RECOVER, XPATH_BINDS, \
+    XPATH_FORM_INSTANCE, XPATH_FR_BODY_ELEMENTS, XPATH_RESOURCES, XPATH_RUNNER_FORM_ELEMENTS
+
+XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
 
 # `xforms:` types are here for backwards compatibility.
 XF_TYPE_CONTROL = {
@@ -55,14 +61,42 @@ XF_TYPE_CONTROL = {
 }
 
 
-class Builder:
+class Builder(object):
 
     def __init__(self, xml, lang='en', **kwargs):
+        """
+        @param xml str, or (already parsed) _Element or _ElementTree
+        @param lang str
+        @param fallback_langs list Languages to get resources (labels etc.)
+            from, which are missing or empty in lang
+        @param parse_policy str See utils.generate_xml_root()
+        @param copy bool Copy the xml _Element(Tree), or else take ownership
+            of it (default: True)
+        @param xml_root Element The (already parsed) Builder XML, then xml
+            can be None and is serialized on first access
+        @param lazy bool Construct a control (and convert a resource) on
+            first access, see LazyControls (default: False)
+        """
         self.xml = xml
         self.lang = lang
 
+        self.parse_policy = kwargs.get('parse_policy', PARSE_STRICT_THEN_RECOVER)
+
+        self.fallback_langs = []
+        if kwargs.get('fallback_langs', False):
+            self.set_fallback_langs(kwargs['fallback_langs'])
+
         self.xml_root = None
-        self.set_xml_root()
+        if is_element(xml):
+            self.xml = None
+            self.xml_root = get_element_root(xml, kwargs.get('copy', True))
+        elif kwargs.get('xml_root', None) is not None:
+            self.xml_root = kwargs['xml_root']
+        else:
+            self.set_xml_root()
+
+        self.index = None
+        self.set_index()
 
         self._control_objects = {}
         if kwargs.get('controls', False):
@@ -78,68 +112,207 @@ class Builder:
         self.fr_body_elements = []
         self.set_fr_body_elements()
 
+        self.lazy = kwargs.get('lazy', False)
+
+        # Resource tables by language, converted on first use.
+        self.resources = {}
+
         self.resource = {}
         self.set_resource()
 
         self.controls = {}
         self.set_controls()
 
+        # Stable (integer) slot per control name, by which a Runner holds
+        # its values in slot-aligned lists.
+        self.control_slots = {}
+        self.control_names = []
+        self.set_control_slots()
+
         self.sanitized_control_names = {}
         self.set_sanitized_control_names()
 
         self.form_instance = []
         self.set_form_instance()
 
+        # Form instance (template), see get_form_instance_template()
+        self._form_instance_element = None
+
+        # Views by (lang, fallback_langs), see for_lang()
+        self._lang_views = {(self.lang, tuple(self.fallback_langs)): self}
+
+    @classmethod
+    def from_file(cls, source, lang='en', **kwargs):
+        """
+        Construct by parsing the Builder XML straight from a file. The xml
+        (e.g. for get_key) is then serialized from the tree on demand.
+
+        @param source str (path), file object or mmap
+        """
+        parse_policy = kwargs.get('parse_policy', PARSE_STRICT_THEN_RECOVER)
+        xml_root = parse_xml_file(source, parse_policy)
+        return cls(None, lang, xml_root=xml_root, **kwargs)
+
+    @property
+    def xml(self):
+        if self._xml is None and self.xml_root is not None:
+            self._xml = etree.tostring(self.xml_root, encoding='UTF-8')
+        return self._xml
+
+    @xml.setter
+    def xml(self, xml):
+        self._xml = xml
+
     def set_xml_root(self):
-        self.xml_root = generate_xml_root(self.xml)
+        self.xml_root = generate_xml_root(self.xml, self.parse_policy)
+
+    def set_index(self):
+        self.index = BuilderIndex(self.xml_root)
 
     def set_binds(self):
         # TODO
         # Fix/handle duplicates, due to iteration control(s)
         # Consider whether a self.binds pair, should assign a value as a list, with duplicates.
         # Refactor other code.
-        q_left = "//*[@id='fr-form-binds']//*[name()='xforms:bind']"
-        q_right = "//*[@id='fr-form-binds']//*[name()='xf:bind']"
-
-        query = "%s|%s" % (q_left, q_right)
-
-        for e in self.xml_root.xpath(query):
+        for e in self.index.binds:
             bind_id = u"%s" % e.get('id')
             self.binds[unaccent_unicode(bind_id)] = Bind(self, e)
 
     def set_resource(self):
-        query = "//*[@id='fr-form-resources']/resources//resource[@xml:lang='%s']" % self.lang
+        self.resource = {}
+        langs = [self.lang] + [l for l in self.fallback_langs if l != self.lang]
 
-        resource = self.xml_root.xpath(query)
+        if not any(len(self.index.resources.get(l, [])) == 1 for l in langs):
+            query = "//*[@id='fr-form-resources']/resources//resource[@xml:lang='%s']" % self.lang
+            raise Exception("[orbeon-xml-api] Found %s elements for: %s" % (
+                len(self.index.resources.get(self.lang, [])), query))
 
-        if len(resource) != 1:
-            raise Exception("[orbeon-xml-api] Found %s elements for: %s" % (len(resource), query))
+        if self.lazy:
+            self.resource = LazyResource(self, langs)
+            return
 
-        parser = etree.XMLParser(ns_clean=True, recover=True, encoding='utf-8')
-        resource_root = etree.XML(etree.tostring(resource[0], encoding='UTF-8'), parser)
-        resource_xml = etree.tostring(resource_root, encoding="unicode")
-        res_dict = xmltodict.parse(resource_xml)
+        # Fill in missing (or empty) resource elements by the fallbacks.
+        for lang in langs:
+            for tag, element in self.get_resource_elements(lang).items():
+                if tag in self.resource:
+                    element = merge_resource_element(self.resource[tag].element, element)
+                self.resource[tag] = Resource(self, element)
 
-        for tag, v in res_dict.get('resource', {}).items():
-            tag = u"%s" % tag
+    def get_resource_elements(self, lang):
+        """
+        The resource elements (as dict) of the language, by tag.
 
-            if isinstance(v, list):
-                v = v[0]
-            self.resource[unaccent_unicode(tag)] = Resource(self, v)
+        All languages were collected by the BuilderIndex, so this only
+        converts the resource of the language (once).
+        """
+        if lang not in self.resources:
+            self.resources[lang] = dict(
+                (tag, etree_to_xmltodict(el)) for tag, el in self.get_resource_tag_elements(lang).items())
+
+        return self.resources[lang]
+
+    def get_resource_tag_elements(self, lang):
+        """
+        The resource (lxml) elements of the language, by tag.
+        """
+        resource = self.index.resources.get(lang, [])
+        elements = OrderedDict()
+
+        if len(resource) == 1:
+            # The first element wins, for a tag repeated in the resource.
+            for el in resource[0]:
+                if not isinstance(el.tag, basestring):
+                    continue
+
+                tag = unaccent_unicode(u"%s" % el.tag)
+                if tag not in elements:
+                    elements[tag] = el
+
+        return elements
+
+    def get_resource_langs(self):
+        return self.index.resources.keys()
+
+    def set_fallback_langs(self, fallback_langs):
+        self.fallback_langs = list(fallback_langs)
+
+    def for_lang(self, lang, fallback_langs=None):
+        """
+        View of this Builder in another language.
+
+        The view shares the XML tree, index, binds and (converted) resources
+        with this Builder. Only the controls are (shallow) copied, to carry
+        the labels, hints, alerts and choices of the language.
+
+        @param lang str
+        @param fallback_langs list Defaults to the fallback_langs of this Builder
+        """
+        if fallback_langs is None:
+            fallback_langs = self.fallback_langs
+
+        key = (lang, tuple(fallback_langs))
+
+        if key not in self._lang_views:
+            view = copy.copy(self)
+            view.lang = lang
+            view.set_fallback_langs(fallback_langs)
+            view.set_resource()
+
+            if self.lazy:
+                view.controls = self.controls.for_builder(view)
+                self._lang_views[key] = view
+                return view
+
+            view.controls = {}
+            for name, control in self.controls.items():
+                view_control = copy.copy(control)
+                view_control._builder = view
+                view_control.set_resource()
+                view_control.set_resource_attrs()
+                view.controls[name] = view_control
+
+            for control in view.controls.values():
+                control._parent = None
+                control.set_parent()
+
+            self._lang_views[key] = view
+
+        return self._lang_views[key]
 
     def set_fr_body_elements(self):
-        query = "//*[name()='fr:body']//*[@bind]"
-        self.fr_body_elements = self.xml_root.xpath(query)
+        self.fr_body_elements = self.index.fr_body_elements
 
     def set_controls(self):
-        for el in self.fr_body_elements:
-            el_bind = u"%s" % el.get('bind')
-            bind = self.binds[unaccent_unicode(el_bind)]
+        if self.lazy:
+            self.controls = LazyControls(self, self.iter_control_elements())
+            return
+
+        for bind, el in self.iter_control_elements():
             control = bind.get_fr_control_object(el)
 
             if control is not None:
                 self.controls[bind.name] = control
 
+    def iter_control_elements(self):
+        """
+        (bind, fr:body element) of the controls.
+        """
+        for el in self.fr_body_elements:
+            el_bind = u"%s" % el.get('bind')
+            yield self.binds[unaccent_unicode(el_bind)], el
+
+    def set_control_slots(self):
+        # In document order (of the fr:body), not in the (dict) order of the
+        # controls.
+        names = [bind.name for bind, el in self.iter_control_elements()]
+        names.extend(self.controls.keys())
+
+        for name in names:
+            if name in self.control_slots or name not in self.controls:
+                continue
+            self.control_slots[name] = len(self.control_names)
+            self.control_names.append(name)
+
     def set_sanitized_control_names(self):
         for name in self.controls.keys():
             if name is None:
@@ -158,24 +331,78 @@ class Builder:
         self.context = context
 
     def set_form_instance(self):
-        query = "//*[@id='fr-form-instance']/form/*"
-        res = self.xml_root.xpath(query)
-
-        for root_el in res:
-            for element in root_el.iter():
-                self.form_instance.append(element)
+        self.form_instance = self.index.form_instance
 
     def get_form_instance_raw(self):
-        root = etree.fromstring(self.xml)
-        query = "//*[@id='fr-form-instance']/form"
-        ret = root.xpath(query)
+        return etree.tostring(self.get_form_instance_template(), encoding='unicode')
 
-        # cleanup namespaces
-        parent = etree.Element('form')
-        for child in ret[0]:
-            if child.tag != 'form':
-                parent.append(child)
-        return etree.tostring(parent, encoding='unicode')
+    def get_form_instance_template(self):
+        """
+        The form instance, copied from the (indexed) Builder XML instead of
+        parsed again.
+        """
+        if self._form_instance_element is None:
+            # cleanup namespaces
+            parent = etree.Element('form')
+            for child in self.index.form_instance_forms[0]:
+                if child.tag != 'form':
+                    parent.append(copy.deepcopy(child))
+            self._form_instance_element = parent
+        return self._form_instance_element
+
+    def get_control_bind(self, name):
+        """
+        The bind of a control, without constructing it (lazy).
+        """
+        if self.lazy:
+            return self.controls.get_bind(name)
+        else:
+            return self.controls[name]._bind
+
+    def is_form_control(self, name):
+        """
+        Whether the control has an element in the Runner form, i.e. a parent
+        (e.g. section) control. By the bind graph, so a lazy Builder doesn't
+        construct the control.
+        """
+        bind = self.get_control_bind(name)
+        return bind.parent is not None and bind.parent.name in self.controls
+
+    def get_form_instance_element(self):
+        """
+        New (modifiable) form instance element, e.g. to merge a Runner into.
+        """
+        return copy.deepcopy(self.get_form_instance_template())
+
+    def compile(self):
+        """
+        Compile into a read-only BuilderSchema, which doesn't reference the
+        XML tree and can be shared by many Runners.
+        """
+        from builder_schema import BuilderSchema
+        return BuilderSchema(self)
+
+    def get_key(self):
+        """
+        Content key, by the hash of the XML and language.
+        """
+        return generate_content_key(self.xml, self.lang)
+
+    def save(self, path):
+        """
+        Compile and save to path, see :meth:`BuilderSchema.save`.
+        """
+        self.compile().save(path)
+
+    @staticmethod
+    def load(path, key=None):
+        """
+        Load a (compiled) Builder saved by :meth:`save`.
+
+        @return BuilderSchema
+        """
+        from builder_schema import BuilderSchema
+        return BuilderSchema.load(path, key)
 
     def add_control_object(self, name, control_obj):
         supported = False
@@ -217,7 +444,202 @@ class Builder:
         """
 
 
-class Bind:
+class LazyControls(MutableMapping):
+    """
+    Controls of a (lazy) Builder by name. A Control is constructed on first
+    access and memoized, so reading a few controls of a large form doesn't
+    construct all of them. Membership and iteration (names) don't construct
+    any Control.
+
+    @param builder Builder
+    @param control_elements iterable (bind, fr:body element) per control
+    """
+
+    def __init__(self, builder, control_elements):
+        self.builder = builder
+
+        # name => (bind, element), of all controls.
+        self._elements = OrderedDict()
+        for bind, el in control_elements:
+            self._elements[bind.name] = (bind, el)
+
+        self._controls = {}
+        # Reentrant, because a Control gets its parent (Control) on init.
+        self._lock = threading.RLock()
+
+    def for_builder(self, builder):
+        """
+        The (unconstructed) controls of another view of the Builder, e.g. in
+        another language.
+        """
+        return LazyControls(builder, self._elements.values())
+
+    def __getitem__(self, name):
+        if name in self._controls:
+            return self._controls[name]
+
+        with self._lock:
+            if name not in self._controls:
+                if name not in self._elements:
+                    raise KeyError(name)
+
+                bind, el = self._elements[name]
+                control = bind.get_fr_control_object(el, self.builder)
+                if control is None:
+                    raise KeyError(name)
+                self._controls[name] = control
+
+            return self._controls[name]
+
+    def __setitem__(self, name, control):
+        self._controls[name] = control
+
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+
+        self._elements.pop(name, None)
+        self._controls.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self._elements or name in self._controls
+
+    def __iter__(self):
+        for name in self._elements:
+            yield name
+
+        for name in self._controls.keys():
+            if name not in self._elements:
+                yield name
+
+    def __len__(self):
+        return len(self._elements) + len([name for name in self._controls if name not in self._elements])
+
+    def get_bind(self, name):
+        if name in self._elements:
+            return self._elements[name][0]
+        else:
+            return self._controls[name]._bind
+
+    def get_constructed(self):
+        """
+        Names of the constructed controls.
+        """
+        return self._controls.keys()
+
+
+class LazyResource(Mapping):
+    """
+    Resource of a (lazy) Builder by tag. A resource element is converted,
+    and merged with the fallback languages, on first access.
+
+    @param builder Builder
+    @param langs list The language and its fallback languages
+    """
+
+    def __init__(self, builder, langs):
+        self.builder = builder
+        self.langs = langs
+
+        # lang => {tag: lxml element}
+        self._elements = dict((lang, builder.get_resource_tag_elements(lang)) for lang in langs)
+        self._resource = {}
+
+    def __getitem__(self, tag):
+        if tag not in self._resource:
+            element = None
+            found = False
+
+            for lang in self.langs:
+                if tag in self._elements[lang]:
+                    lang_element = etree_to_xmltodict(self._elements[lang][tag])
+                    element = merge_resource_element(element, lang_element) if found else lang_element
+                    found = True
+
+            if not found:
+                raise KeyError(tag)
+            self._resource[tag] = Resource(self.builder, element)
+
+        return self._resource[tag]
+
+    def __contains__(self, tag):
+        return any(tag in self._elements[lang] for lang in self.langs)
+
+    def __iter__(self):
+        seen = set()
+        for lang in self.langs:
+            for tag in self._elements[lang]:
+                if tag not in seen:
+                    seen.add(tag)
+                    yield tag
+
+    def __len__(self):
+        return len(set(tag for lang in self.langs for tag in self._elements[lang]))
+
+
+def merge_resource_element(element, fallback):
+    """
+    Resource element (dict) with the missing or empty (None) values taken
+    from the fallback resource element.
+    """
+    if not isinstance(element, dict) or not isinstance(fallback, dict):
+        return fallback if element is None else element
+
+    merged = OrderedDict(element)
+    for key, value in fallback.items():
+        if merged.get(key, None) is None:
+            merged[key] = value
+    return merged
+
+
+class BuilderIndex:
+    """
+    Index of the Builder XML, by the precompiled queries once.
+
+    Replaces a (whole document) XPath query per lookup, by dictionaries and
+    lists in document order:
+    - binds: xf:bind elements in fr-form-binds
+    - fr_body_elements (and by bind): elements in fr:body having a @bind
+    - resources: resource elements in fr-form-resources, by xml:lang
+    - form_instance(_forms): the form (descendants) in fr-form-instance
+    - model_instances: //form/<parent>/<name> elements, by (parent, name)
+    """
+
+    def __init__(self, xml_root):
+        self.binds = []
+        self.fr_body_elements = []
+        self.fr_body_elements_by_bind = {}
+        self.resources = {}
+        self.form_instance_forms = []
+        self.form_instance = []
+        self.model_instances = {}
+
+        self.set_index(xml_root)
+
+    def set_index(self, xml_root):
+        self.binds = XPATH_BINDS(xml_root)
+
+        self.fr_body_elements = XPATH_FR_BODY_ELEMENTS(xml_root)
+        for el in self.fr_body_elements:
+            self.fr_body_elements_by_bind.setdefault(el.get('bind'), []).append(el)
+
+        for el in XPATH_RESOURCES(xml_root):
+            self.resources.setdefault(el.get(XML_LANG), []).append(el)
+
+        self.form_instance_forms = XPATH_FORM_INSTANCE(xml_root)
+        for form in self.form_instance_forms:
+            self.form_instance.extend(form.iterdescendants(tag=etree.Element))
+
+        for el in XPATH_RUNNER_FORM_ELEMENTS(xml_root):
+            self.model_instances.setdefault((el.getparent().tag, el.tag), el)
+
+    def get_model_instance(self, parent_name, name):
+        return self.model_instances.get((parent_name, name), None)
+
+
+class Bind(object):
+
+    __slots__ = ('builder', 'element', 'id', 'name', 'xf_type', 'parent', 'children')
 
     def __init__(self, builder, element):
         self.builder = builder
@@ -231,7 +653,11 @@ class Bind:
 
         self.xf_type = element.get('type', 'xf:string')
 
+        # The bind graph is shared: parent and children are the Bind objects
+        # in builder.binds, which holds the binds in document order (so a
+        # parent is always there before its children).
         self.parent = None
+        self.children = []
         self.set_parent()
 
     def set_name(self):
@@ -248,47 +674,86 @@ class Bind:
 
         if etree.QName(parent_element).localname == 'bind' and \
            parent_element.get('id') != 'fr-form-binds':
-            self.parent = Bind(self.builder, parent_element)
+            parent_id = u"%s" % parent_element.get('id')
+            self.parent = self.builder.binds.get(unaccent_unicode(parent_id), None)
         else:
             self.parent = None
 
-    def get_fr_control_object(self, element):
+        if self.parent is not None:
+            self.parent.children.append(self)
+
+    def get_ancestors(self):
+        """
+        Ancestor binds, from the parent up to the top level bind.
+        """
+        ancestors = []
+        bind = self.parent
+
+        while bind is not None:
+            ancestors.append(bind)
+            bind = bind.parent
+
+        return ancestors
+
+    def iter_descendants(self):
+        """
+        Descendant binds in document order, by an iterative (not recursive)
+        walk, so deeply nested forms don't hit the recursion limit.
+        """
+        stack = list(reversed(self.children))
+
+        while stack:
+            bind = stack.pop()
+            yield bind
+            stack.extend(reversed(bind.children))
+
+    def get_fr_control_object(self, element, builder=None):
+        """
+        @param element Element The fr:body element of the control
+        @param builder Builder To construct the control for, e.g. a view in
+            another language (default: the Builder of this bind)
+        """
+        if builder is None:
+            builder = self.builder
+
         fr_control_tag = etree.QName(element).localname
 
         if fr_control_tag in ('select1', 'dropdown-select1'):
-            if self.builder._control_objects.get('Select1Control', False):
-                return self.builder._control_objects.get('Select1Control')(self.builder, self, element)
+            if builder._control_objects.get('Select1Control', False):
+                return builder._control_objects.get('Select1Control')(builder, self, element)
             else:
-                return Select1Control(self.builder, self, element)
+                return Select1Control(builder, self, element)
 
         if fr_control_tag == 'open-select1':
-            if self.builder._control_objects.get('OpenSelect1Control', False):
-                return self.builder._control_objects.get('OpenSelect1Control')(self.builder, self, element)
+            if builder._control_objects.get('OpenSelect1Control', False):
+                return builder._control_objects.get('OpenSelect1Control')(builder, self, element)
             else:
-                return OpenSelect1Control(self.builder, self, element)
+                return OpenSelect1Control(builder, self, element)
 
         elif fr_control_tag == 'select':
-            if self.builder._control_objects.get('SelectControl', False):
-                return self.builder._control_objects.get('SelectControl')(self.builder, self, element)
+            if builder._control_objects.get('SelectControl', False):
+                return builder._control_objects.get('SelectControl')(builder, self, element)
             else:
-                return SelectControl(self.builder, self, element)
+                return SelectControl(builder, self, element)
 
         elif fr_control_tag == 'wpaint':
-            if self.builder._control_objects.get('ImageAnnotationControl', False):
-                return self.builder._control_objects.get('ImageAnnotationControl')(self.builder, self, element)
+            if builder._control_objects.get('ImageAnnotationControl', False):
+                return builder._control_objects.get('ImageAnnotationControl')(builder, self, element)
             else:
-                return ImageAnnotationControl(self.builder, self, element)
+                return ImageAnnotationControl(builder, self, element)
 
         else:
             control_class_name = XF_TYPE_CONTROL[self.xf_type].__name__
 
-            if self.builder._control_objects.get(control_class_name, False):
-                return self.builder._control_objects.get(control_class_name)(self.builder, self, element)
+            if builder._control_objects.get(control_class_name, False):
+                return builder._control_objects.get(control_class_name)(builder, self, element)
             else:
-                return XF_TYPE_CONTROL[self.xf_type](self.builder, self, element)
+                return XF_TYPE_CONTROL[self.xf_type](builder, self, element)
+
 
+class Resource(object):
 
-class Resource:
+    __slots__ = ('builder', 'element')
 
     def __init__(self, builder, element):
         self.builder = builder
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2018 Bob Leers (http://www.novacode.nl)
+# See LICENSE file for full licensing details.
+
+import os
+import threading
+from collections import OrderedDict
+
+from . import __version__
+from builder_schema import BuilderSchema
+from utils import generate_content_key
+
+
+class BuilderCache(object):
+    """
+    In-process LRU cache of compiled Builders (BuilderSchema), keyed by a
+    hash of the Builder XML and the language.
+
+    @param max_size int Maximum number of cached schemas (None: unbounded)
+    @param max_bytes int Maximum summed size of the cached Builder XML
+        documents, as a measure of the memory held (None: unbounded)
+    @param cache_dir str Directory to persist compiled schemas, so they
+        survive (worker) restarts (None: in-process only)
+    """
+
+    def __init__(self, max_size=128, max_bytes=None, cache_dir=None):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.save_errors = 0
+
+        # key => (schema, size), least recently used first.
+        self._schemas = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+
+    def get_key(self, xml, lang):
+        return generate_content_key(xml, lang)
+
+    def get(self, xml, lang='en'):
+        """
+        Get the BuilderSchema for the Builder XML, compiling it on a miss.
+        """
+        key = self.get_key(xml, lang)
+
+        with self._lock:
+            if key in self._schemas:
+                self.hits += 1
+                schema, size = self._schemas.pop(key)
+                self._schemas[key] = (schema, size)
+                return schema
+
+            self.misses += 1
+
+        # Compile outside the lock, so other forms can still be served.
+        schema = None
+        if self.cache_dir:
+            schema = self.load(key)
+
+        if schema is None:
+            schema = BuilderSchema.from_xml(xml, lang)
+            if self.cache_dir:
+                self.save(key, schema)
+
+        self.add(key, schema, len(xml))
+        return schema
+
+    def get_path(self, key):
+        # The file format and version are validated on load, but keep
+        # schemas of different library versions apart anyway.
+        return os.path.join(self.cache_dir, '%s-%s.schema' % (key, __version__))
+
+    def load(self, key):
+        path = self.get_path(key)
+
+        if not os.path.exists(path):
+            return None
+
+        try:
+            schema = BuilderSchema.load(path, key)
+        except Exception:
+            # Stale or damaged file; compiling replaces it.
+            return None
+
+        with self._lock:
+            self.disk_hits += 1
+        return schema
+
+    def save(self, key, schema):
+        """
+        Persist the schema, best-effort. An unwritable or full cache
+        directory mustn't fail the construction of a Runner; the schema is
+        compiled again by the next process.
+        """
+        try:
+            schema.save(self.get_path(key))
+        except Exception:
+            with self._lock:
+                self.save_errors += 1
+
+    def add(self, key, schema, size):
+        with self._lock:
+            if key in self._schemas:
+                self._bytes -= self._schemas.pop(key)[1]
+
+            self._schemas[key] = (schema, size)
+            self._bytes += size
+            self.evict()
+
+    def evict(self):
+        with self._lock:
+            while self._schemas and (
+                    (self.max_size is not None and len(self._schemas) > self.max_size) or
+                    (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                key, (schema, size) = self._schemas.popitem(last=False)
+                self._bytes -= size
+
+    def set_max_size(self, max_size):
+        self.max_size = max_size
+        self.evict()
+
+    def set_max_bytes(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.evict()
+
+    def set_cache_dir(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def clear(self):
+        with self._lock:
+            self._schemas.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.disk_hits = 0
+            self.save_errors = 0
+
+    def get_info(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'save_errors': self.save_errors,
+                'size': len(self._schemas),
+                'bytes': self._bytes,
+                'max_size': self.max_size,
+                'max_bytes': self.max_bytes,
+            }
+
+    def __len__(self):
+        return len(self._schemas)
+
+    def __contains__(self, key):
+        return key in self._schemas
+
+
+# Used by Runner, when constructed with builder_xml.
+builder_cache = BuilderCache()
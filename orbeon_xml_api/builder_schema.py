@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2018 Bob Leers (http://www.novacode.nl)
+# See LICENSE file for full licensing details.
+
+import copy
+import cPickle as pickle
+import os
+import zlib
+from collections import Mapping
+from lxml import etree
+
+from . import __version__
+from builder import Builder, Resource
+from controls import ResourceElement
+from utils import get_attrs
+
+# Bump on incompatible changes of the saved (pickled) schema.
+SCHEMA_FILE_FORMAT = 3
+
+
+class BuilderSchema(object):
+    """
+    Compiled, tree-free form of a Builder.
+
+    Holds the bind graph, controls (kinds, labels, hints, alerts, choices
+    and default values) and the form instance, without any reference to the
+    Builder XML tree. A schema is read-only, so one schema can be shared by
+    many Runners, threads and (forked) worker processes.
+
+    Read-only are its attributes and mappings (controls, binds, resource,
+    control_slots, sanitized_control_names), not the Control, Bind and
+    Resource objects in these. Don't modify those: a Runner sets its
+    attributes on a copy, see Control.runner_copy().
+    """
+
+    def __init__(self, builder):
+        """
+        @param builder Builder
+        """
+        self._frozen = False
+
+        self.key = builder.get_key()
+        self.lang = builder.lang
+        self.context = builder.context
+        self._control_objects = dict(builder._control_objects)
+
+        self.binds = {}
+        self.set_binds(builder)
+
+        self.resource = {}
+        self.set_resource(builder)
+
+        self.controls = {}
+        self.set_controls(builder)
+
+        self.control_slots = dict(builder.control_slots)
+        self.control_names = list(builder.control_names)
+
+        self.sanitized_control_names = dict(builder.sanitized_control_names)
+
+        self.form_instance_raw = builder.get_form_instance_raw()
+
+        self.binds = FrozenMapping(self.binds)
+        self.resource = FrozenMapping(self.resource)
+        self.controls = FrozenMapping(self.controls)
+        self.control_slots = FrozenMapping(self.control_slots)
+        self.control_names = tuple(self.control_names)
+        self.sanitized_control_names = FrozenMapping(self.sanitized_control_names)
+
+        self._frozen = True
+
+    @classmethod
+    def from_xml(cls, xml, lang='en', **kwargs):
+        return cls(Builder(xml, lang, **kwargs))
+
+    @classmethod
+    def load(cls, path, key=None):
+        """
+        Load a schema saved by :meth:`save`.
+
+        Only load files from a trusted location, because the schema is
+        stored as a pickle.
+
+        @param path str
+        @param key str Expected content key (see :meth:`Builder.get_key`)
+        """
+        with open(path, 'rb') as f:
+            header = pickle.load(f)
+
+            if header.get('format') != SCHEMA_FILE_FORMAT or header.get('version') != __version__:
+                raise Exception("[orbeon-xml-api] Incompatible schema file (format %s, version %s): %s" % (
+                    header.get('format'), header.get('version'), path))
+
+            if key is not None and header.get('key') != key:
+                raise Exception("[orbeon-xml-api] Schema file has key %s, expected %s: %s" % (
+                    header.get('key'), key, path))
+
+            return pickle.loads(zlib.decompress(f.read()))
+
+    def save(self, path):
+        """
+        Save as a compact (compressed pickle) file, which is loaded without
+        any XML parsing.
+        """
+        header = {
+            'format': SCHEMA_FILE_FORMAT,
+            'version': __version__,
+            'key': self.key,
+        }
+        payload = zlib.compress(pickle.dumps(self, pickle.HIGHEST_PROTOCOL))
+
+        # Write and rename, so concurrent loaders never see a partial file.
+        tmp_path = '%s.%s.tmp' % (path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+                f.write(payload)
+            os.rename(tmp_path, path)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The context is runtime state (e.g. an ORM environment), which
+        # doesn't belong in a saved schema.
+        state['context'] = None
+        return state
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError("BuilderSchema is immutable, can't set: %s" % name)
+        super(BuilderSchema, self).__setattr__(name, value)
+
+    def set_binds(self, builder):
+        for bind_id, bind in builder.binds.items():
+            schema_bind = copy.copy(bind)
+            schema_bind.builder = self
+            schema_bind.element = FrozenElement(bind.element, deep=False)
+            self.binds[bind_id] = schema_bind
+
+        for schema_bind in self.binds.values():
+            if schema_bind.parent is not None:
+                schema_bind.parent = self.binds.get(schema_bind.parent.id)
+
+            schema_bind.children = [self.binds[child.id] for child in schema_bind.children
+                                    if child.id in self.binds]
+
+    def set_resource(self, builder):
+        for tag, resource in builder.resource.items():
+            self.resource[tag] = Resource(self, resource.element)
+
+    def set_controls(self, builder):
+        for name, control in builder.controls.items():
+            self.controls[name] = self.detach_control(control)
+
+        for name, control in builder.controls.items():
+            if control._parent is not None:
+                parent_name = control._parent._bind.name
+                self.controls[name]._parent = self.controls.get(parent_name)
+
+    def detach_control(self, control):
+        detached = copy.copy(control)
+        detached._builder = self
+        detached._bind = self.binds[control._bind.id]
+        detached._element = FrozenElement(control._element, deep=False)
+        detached._resource = self.resource.get(control._bind.name)
+        detached._resource_element = ResourceElement(detached)
+        detached._runner_decoded = None
+
+        # Anything else still pointing into the Builder tree, e.g. the
+        # model instance or attributes set by a custom Control class.
+        for attr, value in get_attrs(detached).items():
+            if isinstance(value, etree._Element):
+                setattr(detached, attr, FrozenElement(value))
+
+        return detached
+
+    def get_control_bind(self, name):
+        return self.controls[name]._bind
+
+    def is_form_control(self, name):
+        return self.controls[name]._parent is not None
+
+    def get_form_instance_raw(self):
+        return self.form_instance_raw
+
+    def get_form_instance_element(self):
+        return etree.fromstring(self.form_instance_raw)
+
+
+class FrozenMapping(Mapping):
+    """
+    Read-only view of a dict.
+    """
+
+    __slots__ = ('_items',)
+
+    def __init__(self, items):
+        self._items = items
+
+    def __getitem__(self, key):
+        return self._items[key]
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __repr__(self):
+        return 'FrozenMapping(%r)' % self._items
+
+
+class FrozenElement(object):
+    """
+    Read-only, tree-free snapshot of an lxml Element.
+
+    Supports the (small) Element API used by the Controls: tag, text,
+    attrib, get(), getchildren() and iteration over the children.
+    """
+
+    __slots__ = ('tag', 'text', 'attrib', 'children')
+
+    def __init__(self, element, deep=True):
+        self.tag = element.tag
+        self.text = element.text
+        self.attrib = dict(element.attrib)
+
+        if deep:
+            self.children = tuple(FrozenElement(child) for child in element
+                                  if isinstance(child.tag, basestring))
+        else:
+            self.children = ()
+
+    def get(self, key, default=None):
+        return self.attrib.get(key, default)
+
+    def getchildren(self):
+        return list(self.children)
+
+    def __iter__(self):
+        return iter(self.children)
+
+    def __len__(self):
+        return len(self.children)
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2018 Bob Leers (http://www.novacode.nl)
+# See LICENSE file for full licensing details.
+
+from collections import OrderedDict
+
+import numpy
+
+from controls import get_text_element, SelectControl, StringControl
+from runner import get_field_names
+from utils import generate_xml_root, get_element_root, is_element, unaccent_unicode, \
+    PARSE_STRICT_THEN_RECOVER, XPATH_RUNNER_FORM_ELEMENTS
+
+# Kinds of columns, see Column.
+TYPED = 'typed'
+CATEGORY = 'category'
+CHOICES = 'choices'
+OBJECT = 'object'
+
+
+class Column(object):
+    """
+    The values of one field (control) across many Runner documents.
+
+    By the kind (of the control):
+
+    - typed: a masked array by Control.decode_array(), e.g. datetime64
+      (dates), float64/int64 (decimals) and bool (booleans). Masked where
+      the document has no (valid) value.
+    - category: codes (int32, -1 where no value) into the categories, the
+      distinct values. Text and (single) choice controls.
+    - choices: a masked bool matrix (document x category) of the selected
+      categories. Multiple choice controls.
+    - object: an object array of the decode() values, e.g. times and
+      custom Control classes.
+
+    @param name str Control name
+    @param kind str
+    @param values numpy.ndarray
+    @param categories list Category values (category, choices)
+    @param labels list Category labels, of the choices in the Builder
+        language (else None)
+    """
+
+    def __init__(self, name, kind, values, categories=None, labels=None):
+        self.name = name
+        self.kind = kind
+        self.values = values
+        self.categories = categories
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.values)
+
+
+def extract(builder, docs, fields=None, **kwargs):
+    """
+    Extract the values of the fields from many Runner documents (of one
+    Builder) into columns, without constructing a Runner per document.
+
+    Requires numpy.
+
+    @param builder Builder or BuilderSchema
+    @param docs iterable Runner XML documents: str or (already parsed)
+        _Element or _ElementTree
+    @param fields list Control (or section) names, see Runner fields
+        (default: all controls in the Runner form)
+    @param parse_policy str See utils.generate_xml_root()
+    @return OrderedDict name => Column
+    """
+    parse_policy = kwargs.get('parse_policy', PARSE_STRICT_THEN_RECOVER)
+
+    if fields is None:
+        names = set(builder.controls.keys())
+    else:
+        names = get_field_names(builder, fields)
+
+    # As in the Runner: the controls (in the form) have a parent section.
+    names = [name for name in builder.control_names
+             if name in names and builder.is_form_control(name)]
+    controls = dict((name, builder.controls[name]) for name in names)
+    kinds = dict((name, get_column_kind(control)) for name, control in controls.items())
+
+    # Texts (or decoded values, of object columns) per name, by document.
+    collected = dict((name, []) for name in names)
+
+    for index, doc in enumerate(docs):
+        if is_element(doc):
+            xml_root = get_element_root(doc, copy=False)
+        else:
+            xml_root = generate_xml_root(doc, parse_policy)
+
+        if xml_root is None:
+            raise Exception("[orbeon-xml-api] No (valid) Runner XML, document %s" % index)
+
+        elements = {}
+        for element in XPATH_RUNNER_FORM_ELEMENTS(xml_root):
+            elements[unaccent_unicode(u"%s" % element.tag)] = element
+
+        for name in names:
+            element = elements.get(name)
+
+            if kinds[name] == OBJECT:
+                value = controls[name].decode(element) if element is not None else None
+                collected[name].append(value)
+            else:
+                collected[name].append(element.text if element is not None else None)
+
+    columns = OrderedDict()
+    for name in names:
+        columns[name] = get_column(controls[name], kinds[name], collected[name])
+    return columns
+
+
+def get_column_kind(control):
+    if control.has_decode_array():
+        return TYPED
+
+    # The decode() of the (custom) Control class
+    decode_cls = get_decode_class(control)
+    if decode_cls is SelectControl:
+        return CHOICES
+    elif decode_cls is StringControl:
+        return CATEGORY
+    else:
+        return OBJECT
+
+
+def get_decode_class(control):
+    for cls in type(control).__mro__:
+        if 'decode' in cls.__dict__:
+            return cls
+
+
+def get_column(control, kind, texts):
+    name = control._bind.name
+
+    if kind == TYPED:
+        return Column(name, kind, get_typed_values(control, texts))
+    elif kind == CATEGORY:
+        codes, categories = get_category_codes(texts)
+        return Column(name, kind, codes, categories, get_choice_labels(control, categories))
+    elif kind == CHOICES:
+        values, categories = get_choices_matrix(control, texts)
+        return Column(name, kind, values, categories, get_choice_labels(control, categories))
+    else:
+        values = numpy.empty(len(texts), dtype=object)
+        values[:] = texts
+        return Column(name, kind, values)
+
+
+def get_typed_values(control, texts):
+    try:
+        return control.decode_array(texts)
+    except (ValueError, TypeError, OverflowError):
+        pass
+
+    # Mask the values decode() rejects only, e.g. decoded to "<text> (!)",
+    # by the scalar decode() per value and one decode_array().
+    valid_texts = [text if text is None or is_valid_text(control, text) else None for text in texts]
+    try:
+        return control.decode_array(valid_texts)
+    except (ValueError, TypeError, OverflowError):
+        pass
+
+    # E.g. an integer decode() holds, but int64 doesn't.
+    valid_texts = []
+    for text in texts:
+        try:
+            control.decode_array([text])
+            valid_texts.append(text)
+        except (ValueError, TypeError, OverflowError):
+            valid_texts.append(None)
+
+    return control.decode_array(valid_texts)
+
+
+def is_valid_text(control, text):
+    try:
+        value = control.decode(get_text_element(control._bind.name, text))
+    except (ValueError, TypeError, OverflowError):
+        return False
+
+    # An invalid date (time) decodes to "<text> (!)".
+    return not isinstance(value, basestring)
+
+
+def get_category_codes(texts):
+    """
+    @return (codes, categories) Codes (-1: no value) into the categories,
+        which are in order of appearance
+    """
+    index = {None: -1}
+    categories = []
+    codes = numpy.empty(len(texts), dtype=numpy.int32)
+
+    for i, text in enumerate(texts):
+        code = index.get(text)
+        if code is None:
+            code = index[text] = len(categories)
+            categories.append(text)
+        codes[i] = code
+
+    return codes, categories
+
+
+def get_choices_matrix(control, texts):
+    """
+    @return (values, categories) Masked bool matrix (where no value) of the
+        selected categories, which are the choices (in item order) and any
+        other (selected) values
+    """
+    categories = control._choice_index.sort_values(control._choice_index.positions)
+    index = dict((value, i) for i, value in enumerate(categories))
+
+    selected = []
+    for text in texts:
+        codes = []
+        if text is not None:
+            for value in control.decode(get_text_element(control._bind.name, text)):
+                if value not in index:
+                    index[value] = len(categories)
+                    categories.append(value)
+                codes.append(index[value])
+        selected.append(codes)
+
+    values = numpy.zeros((len(texts), len(categories)), dtype=bool)
+    for i, codes in enumerate(selected):
+        values[i, codes] = True
+
+    mask = numpy.zeros(values.shape, dtype=bool)
+    mask[[i for i, text in enumerate(texts) if text is None]] = True
+    return numpy.ma.masked_array(values, mask=mask), categories
+
+
+def get_choice_labels(control, categories):
+    choice_index = getattr(control, '_choice_index', None)
+    if choice_index is None:
+        return None
+    return [choice_index.get_label(value) for value in categories]
@@ -5,26 +5,185 @@
 from datetime import datetime, time
 from lxml import etree
 
+import re
 import xmltodict
 
+try:
+    import numpy
+except ImportError:
+    # Optional, for the vectorized decode_array()
+    numpy = None
+
+from utils import parse_iso_date, parse_iso_datetime, parse_iso_time
+
 
 class ResourceElement(object):
     """
     The Resource Element of a Control (fr-form-resources)
     """
 
+    __slots__ = ('control',)
+
     def __init__(self, control):
         self.control = control
 
     def __getattr__(self, name):
+        # Don't resolve special (e.g. pickle/copy) attributes by the resource.
+        if name.startswith('__'):
+            raise AttributeError(name)
+
         if self.control._resource and hasattr(self.control._resource, 'element'):
             return self.control._resource.element.get(name, None)
         else:
             return None
 
 
+def get_text_element(tag, text):
+    """
+    (Runner) element of a text, to decode a text by Control.decode().
+    """
+    element = etree.Element(tag)
+    element.text = text
+    return element
+
+
+# Codes of the Boolean values (other texts decode to None)
+BOOLEAN_CODES = {'true': 1, 'false': 0}
+
+
+def get_texts(elements_or_texts):
+    """
+    @param elements_or_texts iterable Elements, texts (str) or None
+    @return list str or None
+    """
+    return [item if item is None or isinstance(item, basestring) else getattr(item, 'text', None)
+            for item in elements_or_texts]
+
+
+def get_masked_texts(texts, fill, is_valid=None):
+    """
+    The texts (filled where None) and the mask (True where None), for a
+    vectorized decode_array().
+
+    @param fill str Replaces None
+    @param is_valid callable The (not None) text is parsed by numpy as
+        decode() would, else ValueError is raised
+    """
+    filled = []
+    mask = []
+
+    for text in texts:
+        if text is None:
+            filled.append(fill)
+            mask.append(True)
+        elif is_valid is None or is_valid(text):
+            filled.append(text)
+            mask.append(False)
+        else:
+            raise ValueError(text)
+
+    return filled, mask
+
+
+def get_masked_values(texts, parse):
+    """
+    The values parsed from the texts (None where None) and the mask (True
+    where None), for a decode_array() of texts numpy doesn't parse.
+
+    @param parse callable Parses a (not None) text, or raises ValueError
+    """
+    values = []
+    mask = []
+
+    for text in texts:
+        if text is None:
+            values.append(None)
+            mask.append(True)
+        else:
+            values.append(parse(text))
+            mask.append(False)
+
+    return values, mask
+
+
+# The fixed formats numpy parses alike decode(). The year is (ASCII) 4
+# digits and not 0, because numpy also holds years a Python date can't.
+ISO_DATE_FIXED_RE = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}\Z')
+ISO_DATETIME_FIXED_RE = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}\Z')
+
+
+def is_iso_date(text):
+    return ISO_DATE_FIXED_RE.match(text) is not None and not text.startswith('0000')
+
+
+def is_iso_datetime(text):
+    return ISO_DATETIME_FIXED_RE.match(text) is not None and not text.startswith('0000')
+
+
+class ChoiceIndex(object):
+    """
+    The choices (items) of a Select1/Select Control in one language,
+    indexed by value and label, so a Runner resolves its choices without
+    scanning the items.
+
+    @param resource Resource The resource of the Control (or None)
+    """
+
+    __slots__ = ('labels', 'values', 'positions')
+
+    def __init__(self, resource):
+        # value => label, label => value, value => position (item order)
+        self.labels = {}
+        self.values = {}
+        self.positions = {}
+
+        items = []
+        if resource is not None:
+            items = resource.element.get('item', None) or []
+
+        # A single item (xmltodict) isn't in a list.
+        if isinstance(items, dict):
+            items = [items]
+
+        for position, item in enumerate(items):
+            # XXX Seems a buggy assumption. Things like 'label'.
+            if not isinstance(item, dict):
+                continue
+
+            value = item.get('value', None)
+            label = item.get('label', None)
+
+            # The last item with a value wins, as it did by scanning.
+            self.labels[value] = label
+            self.positions[value] = position
+
+            if isinstance(label, basestring) and label not in self.values:
+                self.values[label] = value
+
+    def get_label(self, value):
+        return self.labels.get(value, None)
+
+    def get_value(self, label):
+        return self.values.get(label, None)
+
+    def sort_values(self, values):
+        """
+        The (known, distinct) values in the order of the items.
+        """
+        return sorted(set(value for value in values if value in self.positions), key=self.positions.get)
+
+
 class Control(object):
 
+    # Slotted (no instance __dict__) to keep the many controls of many
+    # Builders compact. A custom Control class (see Builder controls kwarg)
+    # doesn't need to declare __slots__, it then gets a __dict__ as usual.
+    __slots__ = (
+        '_builder', '_bind', '_element', '_context', '_parent', '_resource', '_model_instance',
+        'default_raw_value', 'default_value', '_resource_element', 'label', 'hint', 'alert',
+        '_raw_value', '_runner_decoded', '_builder_control',
+    )
+
     def __init__(self, builder, bind, element):
         self._builder = builder
         self._bind = bind
@@ -50,27 +209,55 @@ class Control(object):
         self.default_value = None
         self.set_default_value()
 
-        self._resource_element = ResourceElement(self)
-
-        # Attributes via Element (which get these dynamically)
+        self._resource_element = None
         self.label = None
         self.hint = None
         self.alert = None
-
-        if self._resource:
-            self.label = self._resource.element.get('label', None)
-            self.hint = self._resource.element.get('hint', None)
-            self.alert = self._resource.element.get('alert', None)
+        self.set_resource_attrs()
 
         self._raw_value = None
         self.set_raw_value()
 
+        # (runner element, decoded value), see runner_decode()
+        self._runner_decoded = None
+
         self.init()
 
     def init(self):
         """ This method is called after :meth:`~._init__`."""
         pass
 
+    def __getattr__(self, name):
+        # A Runner copy gets anything but its Runner (form) attributes from
+        # the Builder control, see runner_copy().
+        if name.startswith('__') or name == '_builder_control':
+            raise AttributeError(name)
+
+        # An unset slot ends up here too, so read the (slot) attribute
+        # without delegating again.
+        try:
+            builder_control = object.__getattribute__(self, '_builder_control')
+        except AttributeError:
+            builder_control = None
+
+        if builder_control is None:
+            raise AttributeError(name)
+
+        return getattr(builder_control, name)
+
+    def runner_copy(self):
+        """
+        Lightweight (flyweight) copy of this Builder control for a Runner.
+        It only holds the Runner (form) attributes (e.g. value, raw_value,
+        choice), anything else (label, resource etc.) is read from this
+        control, which is left untouched. So one Builder can be shared by
+        many (concurrent) Runners.
+        """
+        runner_control = self.__class__.__new__(self.__class__)
+        runner_control._builder_control = self
+        runner_control._runner_decoded = None
+        return runner_control
+
     def add_context(self, context):
         self._context = context
 
@@ -82,25 +269,46 @@ class Control(object):
         if not self._bind.parent:
             return
 
-        # TODO namespace prefix Error
-        # query = "//xf:model/xf:instance/form/%s/%s" % (
-        query = "//form/%s/%s" % (
+        # By the index of: //form/<parent>/<name>
+        self._model_instance = self._builder.index.get_model_instance(
             self._bind.parent.name,
             self._bind.name
         )
 
-        res = self._builder.xml_root.xpath(query)
-
-        if len(res) > 0:
-            self._model_instance = res[0]
-
     def set_resource(self):
         if self._bind.name in self._builder.resource:
             self._resource = self._builder.resource[self._bind.name]
+        else:
+            self._resource = None
+
+    def set_resource_attrs(self):
+        """
+        Set the (language dependent) attributes by the resource.
+        """
+        self._resource_element = ResourceElement(self)
+
+        # Attributes via Element (which get these dynamically)
+        self.label = None
+        self.hint = None
+        self.alert = None
+
+        if self._resource:
+            self.label = self._resource.element.get('label', None)
+            self.hint = self._resource.element.get('hint', None)
+            self.alert = self._resource.element.get('alert', None)
 
     def init_runner_form_attrs(self, runner_element):
         raise NotImplementedError
 
+    def runner_decode(self, runner_element):
+        """
+        Decode the Runner element once, for both the Runner values and the
+        Runner form attributes.
+        """
+        if self._runner_decoded is None or self._runner_decoded[0] is not runner_element:
+            self._runner_decoded = (runner_element, self.decode(runner_element))
+        return self._runner_decoded[1]
+
     def set_default_raw_value(self):
         raise NotImplementedError
 
@@ -124,11 +332,62 @@ class Control(object):
         """
         raise NotImplementedError
 
+    def decode_many(self, elements_or_texts):
+        """
+        Decode many Runner elements of this control, e.g. one field across
+        many submissions. Gives the same values as decode(), by the
+        vectorized decode_array() if available (numpy) and applicable.
+
+        @param elements_or_texts iterable Elements, texts (str) or None
+        @return list
+        """
+        items = list(elements_or_texts)
+
+        if numpy is not None and self.has_decode_array():
+            try:
+                return self.decode_array(get_texts(items), utc=False).tolist()
+            except (ValueError, TypeError, OverflowError):
+                # E.g. an invalid value, which decode() handles.
+                pass
+
+        tag = self._bind.name
+        return [self.decode(get_text_element(tag, item) if isinstance(item, basestring) else item)
+                for item in items]
+
+    def decode_array(self, texts, utc=True):
+        """
+        Vectorized decode (by numpy) of the texts, into a masked array
+        which is masked where the text is None.
+
+        @param texts list str or None
+        @param utc bool Normalize a value with a timezone to UTC, because
+            numpy datetime64 is naive. Else such a value raises ValueError,
+            since decode() gives an aware value.
+        @return numpy.ma.MaskedArray
+        @raise ValueError A text isn't decoded (alike decode()) this way
+        """
+        raise NotImplementedError
+
+    def has_decode_array(self):
+        """
+        Whether decode_array() decodes alike decode(), i.e. decode() isn't
+        overridden (e.g. by a custom Control class) below the class which
+        implements decode_array().
+        """
+        for cls in type(self).__mro__:
+            if 'decode_array' in cls.__dict__:
+                return cls is not Control
+            elif 'decode' in cls.__dict__:
+                return False
+        return False
+
 
 class StringControl(Control):
 
+    __slots__ = ('value', 'raw_value')
+
     def init_runner_form_attrs(self, runner_element):
-        self.value = self.decode(runner_element)
+        self.value = self.runner_decode(runner_element)
         self.raw_value = runner_element.text
 
     def set_default_raw_value(self):
@@ -152,8 +411,10 @@ class StringControl(Control):
 
 class DateControl(Control):
 
+    __slots__ = ('value', 'raw_value')
+
     def init_runner_form_attrs(self, runner_element):
-        self.value = self.decode(runner_element)
+        self.value = self.runner_decode(runner_element)
         self.raw_value = runner_element.text
 
     def set_default_raw_value(self):
@@ -170,18 +431,31 @@ class DateControl(Control):
             return None
         else:
             try:
-                return datetime.strptime(element.text, '%Y-%m-%d').date()
+                return parse_iso_date(element.text)
             except:
                 return "%s (!)" % element.text
 
+    def decode_array(self, texts, utc=True):
+        try:
+            filled, mask = get_masked_texts(texts, 'NaT', is_iso_date)
+            return numpy.ma.masked_array(numpy.array(filled, dtype='datetime64[D]'), mask=mask)
+        except ValueError:
+            pass
+
+        # Other forms (e.g. with a timezone), by the parser of decode().
+        values, mask = get_masked_values(texts, parse_iso_date)
+        return numpy.ma.masked_array(numpy.array(values, dtype='datetime64[D]'), mask=mask)
+
     def encode(self, value):
         return datetime.strftime(value, '%Y-%m-%d')
 
 
 class TimeControl(Control):
 
+    __slots__ = ('value', 'raw_value')
+
     def init_runner_form_attrs(self, runner_element):
-        self.value = self.decode(runner_element)
+        self.value = self.runner_decode(runner_element)
         self.raw_value = runner_element.text
 
     def set_default_raw_value(self):
@@ -198,7 +472,7 @@ class TimeControl(Control):
             return None
         else:
             try:
-                return datetime.strptime(element.text, '%H:%M:%S').time()
+                return parse_iso_time(element.text)
             except:
                 return "%s (!)" % element.text
 
@@ -208,8 +482,10 @@ class TimeControl(Control):
 
 class DateTimeControl(Control):
 
+    __slots__ = ('value', 'raw_value')
+
     def init_runner_form_attrs(self, runner_element):
-        self.value = self.decode(runner_element)
+        self.value = self.runner_decode(runner_element)
         self.raw_value = runner_element.text
 
     def set_default_raw_value(self):
@@ -226,18 +502,48 @@ class DateTimeControl(Control):
             return None
         else:
             try:
-                return datetime.strptime(element.text, '%Y-%m-%dT%H:%M:%S')
+                return parse_iso_datetime(element.text)
             except:
                 return "%s (!)" % element.text
 
+    def decode_array(self, texts, utc=True):
+        try:
+            filled, mask = get_masked_texts(texts, 'NaT', is_iso_datetime)
+            return numpy.ma.masked_array(numpy.array(filled, dtype='datetime64[s]'), mask=mask)
+        except ValueError:
+            pass
+
+        # Other forms (fractional seconds, a timezone), by the parser of
+        # decode().
+        values, mask = get_masked_values(texts, parse_iso_datetime)
+        unit = 's'
+
+        for i, value in enumerate(values):
+            if value is None:
+                continue
+
+            if value.tzinfo is not None:
+                if not utc:
+                    raise ValueError(texts[i])
+                value = values[i] = (value - value.utcoffset()).replace(tzinfo=None)
+
+            if value.microsecond % 1000:
+                unit = 'us'
+            elif value.microsecond and unit == 's':
+                unit = 'ms'
+
+        return numpy.ma.masked_array(numpy.array(values, dtype='datetime64[%s]' % unit), mask=mask)
+
     def encode(self, value):
         return datetime.strftime(value, '%Y-%m-%dT%H:%M:%S')
 
 
 class BooleanControl(Control):
 
+    __slots__ = ('choice_value', 'choice_label', 'choice', 'raw_value')
+
     def init_runner_form_attrs(self, runner_element):
-        self.choice_value = self.decode(runner_element)
+        self.choice_value = self.runner_decode(runner_element)
         # TODO translations
         self.choice_label = 'Yes' if self.choice_value else 'No'
         self.choice = {self.choice_label: self.choice_value}
@@ -262,6 +568,11 @@ class BooleanControl(Control):
             elif element.text == 'false':
                 return False
 
+    def decode_array(self, texts, utc=True):
+        # Neither true nor false (or None) decodes to None, so is masked.
+        codes = numpy.array([BOOLEAN_CODES.get(text, -1) for text in texts], dtype=numpy.int8)
+        return numpy.ma.masked_array(codes == 1, mask=codes == -1)
+
     def encode(self, value):
         # TODO isinstance(value, bool) validate?
         if value:
@@ -272,20 +583,20 @@ class BooleanControl(Control):
 
 class Select1Control(StringControl):
 
+    __slots__ = ('choice_value', 'choice_label', 'choice', '_choice_index')
+
+    def set_resource_attrs(self):
+        super(Select1Control, self).set_resource_attrs()
+        self._choice_index = ChoiceIndex(self._resource)
+
     def init_runner_form_attrs(self, runner_element):
-        self.choice_value = self.decode(runner_element)
+        self.choice_value = self.runner_decode(runner_element)
         self.choice_label = None
 
         if not hasattr(self._resource_element, 'element'):
             return
 
-        for item in self._resource.element['item']:
-            # XXX Seems a buggy assumption. Things like 'label'.
-            if isinstance(item, basestring):
-                continue
-            elif item['value'] == self.choice_value:
-                self.choice_label = item['label']
-
+        self.choice_label = self._choice_index.get_label(self.choice_value)
         self.choice = {self.choice_label: self.choice_value}
         self.raw_value = runner_element.text
 
@@ -294,6 +605,9 @@ class Select1Control(StringControl):
 
 
 class OpenSelect1Control(Select1Control):
+
+    __slots__ = ()
+
     def init_runner_form_attrs(self, runner_element):
         super(OpenSelect1Control, self).init_runner_form_attrs(runner_element)
 
@@ -304,31 +618,26 @@ class OpenSelect1Control(Select1Control):
 
 class SelectControl(StringControl):
 
+    __slots__ = ('choices_values', 'choices_labels', 'choices', '_choice_index')
+
+    def set_resource_attrs(self):
+        super(SelectControl, self).set_resource_attrs()
+        self._choice_index = ChoiceIndex(self._resource)
+
     def init_runner_form_attrs(self, runner_element):
         self.raw_value = runner_element.text
-        self.choices_values = self.decode(runner_element)
+        self.choices_values = self.runner_decode(runner_element)
         self.choices_labels = []
         self.choices = {}
 
         if not self.choices_values:
             return
 
-        for item in self._resource.element['item']:
-            label = None
-            value = None
-
-            if isinstance(item, basestring):
-                if item == 'label':
-                    label = item
-                if item == 'value':
-                    value = item
-            else:
-                label = item['label']
-                value = item['value']
-
-            if value in self.choices_values:
-                self.choices_labels.append(label)
-                self.choices[label] = value
+        # In the order of the items.
+        for value in self._choice_index.sort_values(self.choices_values):
+            label = self._choice_index.get_label(value)
+            self.choices_labels.append(label)
+            self.choices[label] = value
 
     def decode(self, element):
         if element is None or not hasattr(element, 'text') or element.text is None:
@@ -342,9 +651,11 @@ class SelectControl(StringControl):
 
 class AnyUriControl(Control):
 
+    __slots__ = ('uri', 'value', 'raw_value')
+
     def init_runner_form_attrs(self, runner_element):
         self.raw_value = runner_element.text
-        decoded = self.decode(runner_element)
+        decoded = self.runner_decode(runner_element)
 
         self.uri = decoded['uri']
         self.value = decoded['value']
@@ -381,9 +692,11 @@ class AnyUriControl(Control):
 
 class ImageAnnotationControl(Control):
 
+    __slots__ = ('image', 'annotation', 'raw_value')
+
     def init_runner_form_attrs(self, runner_element):
         self.raw_value = runner_element.text
-        decoded = self.decode(runner_element)
+        decoded = self.runner_decode(runner_element)
 
         if decoded:
             self.image = decoded['image']['image']
@@ -417,8 +730,10 @@ class ImageAnnotationControl(Control):
 
 class DecimalControl(Control):
 
+    __slots__ = ('value', 'raw_value')
+
     def init_runner_form_attrs(self, runner_element):
-        self.value = self.decode(runner_element)
+        self.value = self.runner_decode(runner_element)
         self.raw_value = runner_element.text
 
     def set_default_raw_value(self):
@@ -441,9 +756,20 @@ class DecimalControl(Control):
             elif hasattr(element, 'text'):
                 return int(element.text)
 
+    def decode_array(self, texts, utc=True):
+        filled, mask = get_masked_texts(texts, '0')
+        precision = int(self._element.get('digits-after-decimal', 1))
+
+        if precision > 0:
+            values = numpy.array(filled, dtype=numpy.float64)
+        else:
+            values = numpy.array(filled, dtype=numpy.int64)
+        return numpy.ma.masked_array(values, mask=mask)
+
     def encode(self, value):
         return str(value)
 
 
 class EmailControl(StringControl):
-    pass
+
+    __slots__ = ()
@@ -3,32 +3,55 @@
 # See LICENSE file for full licensing details.
 
 import re
+from collections import Mapping
 from lxml import etree
 
-from builder import Builder, XF_TYPE_CONTROL
-from utils import generate_xml_root, unaccent_unicode
+from builder import Builder
+from builder_cache import builder_cache
+from builder_schema import BuilderSchema
+from utils import generate_xml_root, get_element_root, is_element, iterparse_form, parse_xml_file, \
+    unaccent_unicode, PARSE_STRICT_THEN_RECOVER, XPATH_RUNNER_FORM_ELEMENTS
 
 
-class Runner:
+class Runner(object):
 
-    def __init__(self, xml, builder=None, builder_xml=None, lang='en'):
+    def __init__(self, xml, builder=None, builder_xml=None, lang='en', **kwargs):
         """
-        @param builder Builder
+        @param xml str, or (already parsed) _Element or _ElementTree
+        @param builder Builder or BuilderSchema
         @param builder_xml str
+        @param copy bool Copy the xml _Element(Tree), or else take ownership
+            of it (default: True)
+        @param xml_root Element The (already parsed) Runner XML, then xml
+            can be None and is serialized on first access
+        @param parse_policy str See utils.generate_xml_root()
+        @param lazy bool Decode a value (and initialize a control) on first
+            access, see RunnerValues and RunnerControls (default: False)
+        @param fields list Names of the controls (or sections, with their
+            controls) to construct the Runner for. Other controls are
+            skipped, e.g. the form attribute of such a control is None.
         """
         self.xml = xml
         self.builder = builder
         self.builder_xml = builder_xml
         self.lang = lang
 
+        self.parse_policy = kwargs.get('parse_policy', PARSE_STRICT_THEN_RECOVER)
+
         self.xml_root = None
-        self.set_xml_root()
+        if is_element(xml):
+            self.xml = None
+            self.xml_root = get_element_root(xml, kwargs.get('copy', True))
+        elif kwargs.get('xml_root', None) is not None:
+            self.xml_root = kwargs['xml_root']
+        else:
+            self.set_xml_root()
 
         if self.builder and self.builder_xml:
             raise Exception("Constructor accepts either builder or builder_xml.")
 
         if self.builder:
-            assert isinstance(self.builder, Builder)
+            assert isinstance(self.builder, (Builder, BuilderSchema))
         elif self.builder_xml:
             assert isinstance(self.builder_xml, basestring)
         else:
@@ -37,13 +60,29 @@ class Runner:
         if self.builder is None and self.builder_xml:
             self.set_builder_by_builder_xml()
 
-        self._form = {}
+        # Projected control names (None: all)
+        self.fields = None
+        if kwargs.get('fields', None) is not None:
+            self.set_fields(kwargs['fields'])
+
+        # Slot-aligned (see Builder.control_slots) raw values, values and
+        # controls, with a name-keyed view (RunnerSlots) of each.
+        slots = len(self.builder.control_names)
+        self._raw_values = [None] * slots
+        self._values = [None] * slots
+        self._controls = [None] * slots
+
+        self.raw_values = RunnerSlots(self, self._raw_values)
+        self.values = RunnerSlots(self, self._values)
+        self.controls = RunnerSlots(self, self._controls)
+
         self.set_form()
 
         # init
-        self.raw_values = {}
-        self.values = {}
-        self.controls = {}
+        self.lazy = kwargs.get('lazy', False)
+
+        # Per Runner copies of the Builder controls (lazy)
+        self._runner_controls = None
 
         self.init()
 
@@ -53,46 +92,120 @@ class Runner:
         # self.form = runner_form
         self.form = RunnerForm(self)
 
+    @classmethod
+    def from_stream(cls, source, builder=None, builder_xml=None, lang='en', **kwargs):
+        """
+        Construct by streaming (iterparse) the Runner XML, keeping only the
+        form elements the Builder has controls for. Other elements (e.g.
+        large attachments) are cleared while parsing, so the memory doesn't
+        grow with the size of the document.
+
+        Hence xml_root (and xml) only holds the form with these elements.
+
+        @param source file object or filename
+        """
+        if builder is None and builder_xml:
+            builder = builder_cache.get(builder_xml, lang)
+        elif builder is None:
+            raise Exception("Provide either the argument: builder or builder_xml.")
+
+        if kwargs.get('fields', None) is not None:
+            names = get_field_names(builder, kwargs['fields'])
+        else:
+            names = builder.controls.keys()
+
+        names = set(name for name in names if builder.is_form_control(name))
+        parse_policy = kwargs.get('parse_policy', PARSE_STRICT_THEN_RECOVER)
+        xml_root = iterparse_form(source, names, parse_policy)
+
+        if xml_root is None:
+            raise Exception("[orbeon-xml-api] No form element in the Runner XML")
+
+        return cls(None, builder, lang=lang, xml_root=xml_root, **kwargs)
+
+    @classmethod
+    def from_file(cls, source, builder=None, builder_xml=None, lang='en', **kwargs):
+        """
+        Construct by parsing the Runner XML straight from a file.
+
+        @param source str (path), file object or mmap
+        """
+        parse_policy = kwargs.get('parse_policy', PARSE_STRICT_THEN_RECOVER)
+        xml_root = parse_xml_file(source, parse_policy)
+        return cls(None, builder, builder_xml, lang, xml_root=xml_root, **kwargs)
+
+    @property
+    def xml(self):
+        if self._xml is None and self.xml_root is not None:
+            self._xml = etree.tostring(self.xml_root)
+        return self._xml
+
+    @xml.setter
+    def xml(self, xml):
+        self._xml = xml
+
     def set_xml_root(self):
-        self.xml_root = generate_xml_root(self.xml)
+        self.xml_root = generate_xml_root(self.xml, self.parse_policy)
 
     def set_builder_by_builder_xml(self):
-        self.builder = Builder(self.builder_xml, self.lang)
+        self.builder = builder_cache.get(self.builder_xml, self.lang)
+
+    def set_fields(self, fields):
+        self.fields = get_field_names(self.builder, fields)
 
     def set_form(self):
-        query = "//form/*/*"
-        res = self.xml_root.xpath(query)
+        """
+        The form elements (raw values) of the Builder controls, by slot.
+        """
+        control_slots = self.builder.control_slots
 
-        for e in res:
+        for e in XPATH_RUNNER_FORM_ELEMENTS(self.xml_root):
             tag = u"%s" % e.tag
-            self._form[unaccent_unicode(tag)] = e
+            name = unaccent_unicode(tag)
+            slot = control_slots.get(name)
 
-    def init(self):
-        for name, control in self.builder.controls.items():
-            # XXX Silence maybe isn't the proper way!
-            element = None
-            try:
-                element = self.get_form_element(name)
-            except:
+            if slot is None or (self.fields is not None and name not in self.fields):
                 continue
 
+            if self.builder.is_form_control(name):
+                self._raw_values[slot] = e
+
+    def init(self):
+        if self.lazy:
+            self.init_lazy()
+            return
+
+        control_names = self.builder.control_names
+
+        for slot, element in enumerate(self._raw_values):
             if element is None:
                 continue
 
-            # if callable(getattr(element, 'getchildren', None)):
-            self.raw_values[name] = element
-            self.values[name] = control.decode(element)
+            control = self.builder.controls[control_names[slot]]
+
+            # The Builder (control) is shared by many runners, so the runner
+            # attributes are set on a (flyweight) copy of the control.
+            control_obj = control.runner_copy()
+
+            # Decoded once, for the value and the runner form attrs.
+            self._values[slot] = control_obj.runner_decode(element)
+            control_obj.init_runner_form_attrs(element)
+            self._controls[slot] = control_obj
 
-            if control not in XF_TYPE_CONTROL.values():
-                control_obj = control
-            else:
-                # Instantiate the control class (these are imported above)
-                control_class = globals()[control.__class__.__name__]
-                control_obj = control_class(self.builder, control._bind, element)
+    def init_lazy(self):
+        self._runner_controls = [None] * len(self._raw_values)
+        self.values = RunnerValues(self, self._values)
+        self.controls = RunnerControls(self, self._controls)
 
-            if control_obj is not None:
-                control_obj.init_runner_form_attrs(element)
-                self.controls[name] = control_obj
+    def get_runner_control(self, name):
+        """
+        Per Runner (flyweight) copy of the Builder control (lazy), without
+        the Runner form attributes yet.
+        """
+        slot = self.builder.control_slots[name]
+        if self._runner_controls[slot] is None:
+            self._runner_controls[slot] = self.builder.controls[name].runner_copy()
+        return self._runner_controls[slot]
 
     def get_form_element(self, name):
         """
@@ -102,12 +215,10 @@ class Runner:
         if name not in self.builder.controls:
             return False
 
-        control = self.builder.controls[name]
-
-        if control._parent is None:
+        if not self.builder.is_form_control(name):
             return None
 
-        return self._form[name]
+        return self._raw_values[self.builder.control_slots[name]]
 
     def get_raw_value(self, name):
         return self.raw_values[name]
@@ -127,28 +238,112 @@ class Runner:
         pass
 
     def merge(self, builder_obj, **kwargs):
-        # TODO Move and rebuild into RunnerCopyBuilderMerge (class)
-        no_copy_prefix = kwargs.get('no_copy_prefix', None)
-        parents = {}
-        merged_form = builder_obj.get_form_instance_raw()
-        merged_form = etree.fromstring(merged_form)
-
-        for element in merged_form.iter():
-            tag = element.tag
-            if tag not in ['annotation', 'image']:
-                if isinstance(tag, basestring):
-                    if no_copy_prefix and tag.startswith(no_copy_prefix):
-                        pass
-                    else:
-                        ov = self.xml_root.xpath('//%s' % tag)
-                        if len(ov) > 0 and ov[0].text:
-                            if len(ov[0].text.strip()) > 0:
-                                element.text = ov[0].text
-
-        merge_form_xml = etree.tostring(merged_form)
-        merge_form_xml = bytes(bytearray(merge_form_xml, encoding='utf-8'))
-        merged_runner = Runner(merge_form_xml, builder_obj)
-        return merged_runner
+        """
+        Merge into the form (instance) of another Builder, see
+        :class:`RunnerCopyBuilderMerge`.
+
+        @param builder_obj Builder or BuilderSchema
+        @param no_copy_prefix str Don't copy values of elements (tags)
+            with this prefix
+        """
+        from runner_copy_builder_merge import RunnerCopyBuilderMerge
+        merger = RunnerCopyBuilderMerge(self, builder_obj, **kwargs)
+        return merger.merge()
+
+
+def get_field_names(builder, fields):
+    """
+    Control names of the fields, with a section (or grid etc.) expanded into
+    its (descendant) controls.
+
+    @param builder Builder or BuilderSchema
+    @param fields list Control or section names
+    @return set
+    """
+    names = set()
+
+    for field in fields:
+        if field not in builder.controls:
+            raise Exception("[orbeon-xml-api] Unknown field: %s" % field)
+
+        bind = builder.get_control_bind(field)
+        names.add(bind.name)
+
+        for descendant in bind.iter_descendants():
+            if descendant.name in builder.controls:
+                names.add(descendant.name)
+
+    return names
+
+
+class RunnerSlots(Mapping):
+    """
+    Name-keyed view of a slot-aligned list of a Runner (raw values, values
+    or controls), by the name => slot map of the Builder. Only the controls
+    in the Runner form (having a raw value) are keys.
+
+    @param runner Runner
+    @param slots list
+    """
+
+    __slots__ = ('runner', 'slots')
+
+    def __init__(self, runner, slots):
+        self.runner = runner
+        self.slots = slots
+
+    def __getitem__(self, name):
+        slot = self.runner.builder.control_slots.get(name)
+        if slot is None or self.runner._raw_values[slot] is None:
+            raise KeyError(name)
+        return self.get_slot(slot)
+
+    def get_slot(self, slot):
+        return self.slots[slot]
+
+    def __contains__(self, name):
+        slot = self.runner.builder.control_slots.get(name)
+        return slot is not None and self.runner._raw_values[slot] is not None
+
+    def __iter__(self):
+        for name, element in zip(self.runner.builder.control_names, self.runner._raw_values):
+            if element is not None:
+                yield name
+
+    def __len__(self):
+        return len(self.runner._raw_values) - self.runner._raw_values.count(None)
+
+
+class RunnerValues(RunnerSlots):
+    """
+    Values of a (lazy) Runner by name, decoded on first access.
+    """
+
+    __slots__ = ()
+
+    def get_slot(self, slot):
+        name = self.runner.builder.control_names[slot]
+        element = self.runner._raw_values[slot]
+        return self.runner.get_runner_control(name).runner_decode(element)
+
+
+class RunnerControls(RunnerSlots):
+    """
+    Controls of a (lazy) Runner by name, which get their Runner form
+    attributes (value, choices etc.) on first access.
+    """
+
+    __slots__ = ()
+
+    def get_slot(self, slot):
+        if self.slots[slot] is None:
+            name = self.runner.builder.control_names[slot]
+            control = self.runner.get_runner_control(name)
+            control.init_runner_form_attrs(self.runner._raw_values[slot])
+            self.slots[slot] = control
+
+        return self.slots[slot]
+
 
 class RunnerForm:
 
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2018 Bob Leers (http://www.novacode.nl)
+# See LICENSE file for full licensing details.
+
+import multiprocessing
+from collections import deque, namedtuple
+from itertools import islice
+from lxml import etree
+
+from builder import Builder
+from runner_copy_builder_merge import MergePlan
+from utils import generate_xml_root
+
+# Result per Runner XML document; either xml (merged) or error is set.
+BulkMergeResult = namedtuple('BulkMergeResult', ['index', 'xml', 'error'])
+
+# The MergePlan of a worker process, or the error compiling it, see
+# init_worker().
+_worker_plan = None
+_worker_error = None
+
+# Seconds to wait on a task, before polling the others (unordered).
+POLL_INTERVAL = 0.01
+
+
+class RunnerBulkMerge(object):
+    """
+    Merge (migrate) many Runner XML documents into the form of a Builder,
+    e.g. a new version of the form, across a pool of worker processes.
+
+    The Builder is compiled (BuilderSchema) once and handed to the workers,
+    by fork or pickled, where the MergePlan is compiled once per worker.
+
+    @param builder Builder or BuilderSchema to merge into (new version)
+    @param builder_v1 Builder or BuilderSchema of the Runners (old version),
+        see :class:`MergePlan`
+    @param no_copy_prefix str Don't copy values of elements (tags) with
+        this prefix
+    @param processes int Number of worker processes (None: CPU count, 0:
+        merge in this process)
+    @param chunksize int Number of documents per task
+    @param max_pending int Maximum number of tasks in flight, which bounds
+        the memory held (None: 2 per process)
+    @param ordered bool Yield the results in input order, or as they
+        complete
+    """
+
+    def __init__(self, builder, builder_v1=None, **kwargs):
+        self.builder = self.compile_builder(builder)
+        self.builder_v1 = self.compile_builder(builder_v1)
+
+        self.no_copy_prefix = kwargs.get('no_copy_prefix', None)
+        self.processes = kwargs.get('processes', None)
+        self.chunksize = kwargs.get('chunksize', 16)
+        self.ordered = kwargs.get('ordered', True)
+
+        self.max_pending = kwargs.get('max_pending', None)
+        if self.max_pending is None:
+            self.max_pending = 2 * (self.processes or multiprocessing.cpu_count())
+
+    def compile_builder(self, builder):
+        if isinstance(builder, Builder):
+            return builder.compile()
+        else:
+            return builder
+
+    def merge(self, runner_xmls):
+        """
+        Generator of a BulkMergeResult per Runner XML document. A document
+        which fails to merge yields its error, instead of aborting.
+
+        @param runner_xmls iterable Runner XML documents (str)
+        """
+        chunks = self.iter_chunks(runner_xmls)
+
+        if self.processes == 0:
+            plan = self.compile_plan()
+            for chunk in chunks:
+                for result in merge_chunk(chunk, plan):
+                    yield result
+            return
+
+        pool = multiprocessing.Pool(
+            self.processes,
+            initializer=init_worker,
+            initargs=(self.builder, self.builder_v1, self.no_copy_prefix)
+        )
+
+        try:
+            if self.ordered:
+                results = self.iter_ordered(pool, chunks)
+            else:
+                results = self.iter_unordered(pool, chunks)
+
+            for result in results:
+                yield result
+        finally:
+            # Also when stopped early: no more tasks are submitted and the
+            # pending ones (max_pending) are finished. Pool.terminate() can
+            # deadlock while the task handler feeds the workers.
+            pool.close()
+            pool.join()
+
+    def compile_plan(self):
+        return MergePlan(self.builder, self.builder_v1, no_copy_prefix=self.no_copy_prefix)
+
+    def iter_chunks(self, runner_xmls):
+        docs = enumerate(runner_xmls)
+        while True:
+            chunk = list(islice(docs, self.chunksize))
+            if not chunk:
+                return
+            yield chunk
+
+    def iter_ordered(self, pool, chunks):
+        pending = deque()
+
+        for chunk in chunks:
+            pending.append(pool.apply_async(merge_chunk, (chunk,)))
+
+            if len(pending) >= self.max_pending:
+                for result in pending.popleft().get():
+                    yield result
+
+        while pending:
+            for result in pending.popleft().get():
+                yield result
+
+    def iter_unordered(self, pool, chunks):
+        pending = []
+
+        for chunk in chunks:
+            pending.append(pool.apply_async(merge_chunk, (chunk,)))
+
+            if len(pending) >= self.max_pending:
+                for result in pop_ready(pending).get():
+                    yield result
+
+        while pending:
+            for result in pop_ready(pending).get():
+                yield result
+
+
+def pop_ready(pending):
+    """
+    Pop the first completed task, waiting for one. Its get() raises the
+    error of a failed task (e.g. an unpicklable result), where a callback
+    would never be called.
+
+    @param pending list AsyncResult
+    """
+    while True:
+        for i, task in enumerate(pending):
+            if task.ready():
+                return pending.pop(i)
+        pending[0].wait(POLL_INTERVAL)
+
+
+def init_worker(builder, builder_v1, no_copy_prefix):
+    global _worker_plan, _worker_error
+
+    # A raising initializer makes the pool restart its workers endlessly,
+    # so the error is reported per document instead, by merge_chunk().
+    try:
+        _worker_plan = MergePlan(builder, builder_v1, no_copy_prefix=no_copy_prefix)
+    except Exception as e:
+        _worker_error = '%s: %s' % (e.__class__.__name__, e)
+
+
+def merge_chunk(chunk, plan=None):
+    """
+    @param chunk list (index, Runner XML) tuples
+    @param plan MergePlan (default: the one of the worker process)
+    """
+    if plan is None:
+        if _worker_plan is None:
+            return [BulkMergeResult(index, None, _worker_error) for index, xml in chunk]
+        plan = _worker_plan
+
+    results = []
+    for index, xml in chunk:
+        try:
+            runner_root = generate_xml_root(xml)
+            if runner_root is None:
+                raise Exception("[orbeon-xml-api] No (valid) Runner XML")
+
+            merged_form = plan.merge_element(runner_root)
+            results.append(BulkMergeResult(index, etree.tostring(merged_form), None))
+        except Exception as e:
+            # Report by message, since not all exceptions can be pickled.
+            results.append(BulkMergeResult(index, None, '%s: %s' % (e.__class__.__name__, e)))
+    return results
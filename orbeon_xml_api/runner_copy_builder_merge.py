@@ -2,7 +2,130 @@
 # Copyright 2017-2018 Bob Leers (http://www.novacode.nl)
 # See LICENSE file for full licensing details.
 
+import copy
+from lxml import etree
+
+from runner import Runner
+
+# Elements of which the value is never copied.
+NO_COPY_TAGS = ('annotation', 'image')
+
+
+class MergePlan(object):
+    """
+    Precompiled merge into the form (instance) of a Builder, which is
+    applied to many Runners, e.g. to migrate all submissions of a form to
+    its new version.
+
+    The copy/default decisions are made once, by the form instances of the
+    Builders:
+
+    - copy: value copied (by tag) from the Runner
+    - added: only in the new Builder, so keeps its default value
+    - excluded: by NO_COPY_TAGS or the no_copy_prefix, keeps its default
+      value
+    - removed: only in the old Builder, so dropped
+
+    @param builder Builder or BuilderSchema to merge into (new version)
+    @param builder_v1 Builder or BuilderSchema of the Runners (old
+        version). If None, all (not excluded) elements are copied.
+    @param no_copy_prefix str Don't copy values of elements (tags) with
+        this prefix
+    """
+
+    def __init__(self, builder, builder_v1=None, **kwargs):
+        self.builder = builder
+
+        self.no_copy_prefix = None
+        if kwargs.get('no_copy_prefix', False):
+            self.no_copy_prefix = kwargs['no_copy_prefix']
+
+        self.template = builder.get_form_instance_element()
+
+        # (position, tag) of the template elements to copy into.
+        self.copied = []
+        self.copy_tags = set()
+        self.added = []
+        self.excluded = []
+        self.removed = []
+        self.set_decisions(builder_v1)
+
+    @classmethod
+    def compile(cls, builder_v1, builder_v2, no_copy_prefix=None):
+        return cls(builder_v2, builder_v1, no_copy_prefix=no_copy_prefix)
+
+    def set_decisions(self, builder_v1):
+        tags_v1 = None
+        if builder_v1 is not None:
+            tags_v1 = set(el.tag for el in builder_v1.get_form_instance_element().iter(tag=etree.Element))
+
+        tags = set()
+        for position, element in enumerate(self.template.iter(tag=etree.Element)):
+            tag = element.tag
+            tags.add(tag)
+
+            if not self.is_copied(tag):
+                self.excluded.append(tag)
+            elif tags_v1 is not None and tag not in tags_v1:
+                self.added.append(tag)
+            else:
+                self.copied.append((position, tag))
+                self.copy_tags.add(tag)
+
+        if tags_v1 is not None:
+            self.removed = sorted(tags_v1 - tags)
+
+    def is_copied(self, tag):
+        if tag in NO_COPY_TAGS:
+            return False
+        elif self.no_copy_prefix and tag.startswith(self.no_copy_prefix):
+            return False
+        else:
+            return True
+
+    def get_runner_elements(self, runner_root):
+        """
+        Index the Runner elements to copy from by tag, in one pass. Per tag,
+        the first element (in document order) is the one to copy from.
+        """
+        elements = {}
+        for element in runner_root.iter(tag=etree.Element):
+            if element.tag in self.copy_tags and element.tag not in elements:
+                elements[element.tag] = element
+        return elements
+
+    def merge_element(self, runner_root):
+        """
+        @param runner_root Element The Runner (form) XML root
+        @return Element The merged form
+        """
+        merged_form = copy.deepcopy(self.template)
+        merged_elements = list(merged_form.iter(tag=etree.Element))
+        runner_elements = self.get_runner_elements(runner_root)
+
+        for position, tag in self.copied:
+            runner_element = runner_elements.get(tag)
+            if runner_element is not None and runner_element.text and runner_element.text.strip():
+                merged_elements[position].text = runner_element.text
+
+        return merged_form
+
+    def apply(self, runner):
+        """
+        @return Runner The merged Runner (of the Builder)
+        """
+        return Runner(None, self.builder, xml_root=self.merge_element(runner.xml_root))
+
+
 class RunnerCopyBuilderMerge:
+    """
+    Merge a Runner into the form (instance) of another Builder, e.g. a new
+    version of the form.
+
+    Values are copied, by tag, from the Runner into the form instance of the
+    Builder. Elements only present in the Builder keep their default value.
+    To merge many Runners, compile a :class:`MergePlan` once instead.
+    """
 
     def __init__(self, runner, builder, **kwargs):
         self.runner = runner
@@ -12,12 +135,12 @@ class RunnerCopyBuilderMerge:
         if kwargs.get('no_copy_prefix', False):
             self.set_no_copy_prefix(kwargs['no_copy_prefix'])
 
-        if kwargs.get('no_copy_prefix', False):
-            self.set_no_copy_prefix(kwargs['no_copy_prefix'])
-
     def set_no_copy_prefix(self, no_copy_prefix):
         self.no_copy_prefix = no_copy_prefix
 
-    # TODO move Runner merge() implementation to this function.
     def merge(self):
-        return self.runner.merge(self.builder, no_copy_prefix=self.no_copy_prefix)
+        """
+        @return Runner The merged Runner (of the Builder)
+        """
+        plan = MergePlan(self.builder, no_copy_prefix=self.no_copy_prefix)
+        return plan.apply(self.runner)
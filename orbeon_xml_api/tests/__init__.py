@@ -1,6 +1,10 @@
 from . import test_builder
+from . import test_builder_cache
+from . import test_builder_schema
 from . import test_runner
 from . import test_control_subclassing
 from . import controls
 from . import test_runner_merge_builder
-
+from . import test_utils
+from . import test_columnar
+from . import test_runner_bulk_merge
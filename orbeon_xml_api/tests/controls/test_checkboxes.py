@@ -4,6 +4,7 @@
 
 from . import CommonTestCase
 from ..controls import SelectControl
+from ...runner import Runner
 
 
 class CheckboxesTestCase(CommonTestCase):
@@ -44,3 +45,11 @@ class CheckboxesTestCase(CommonTestCase):
         self.assertEqual(self.runner.form.checkboxes.choices_values, ['dog', 'fish'])
         self.assertEqual(self.runner.form.checkboxes.choices_labels, ['Dog', 'Fish'])
         self.assertEqual(self.runner.form.checkboxes.choices, {'Dog': 'dog', 'Fish': 'fish'})
+
+    def test_runner_form_item_order(self):
+        runner_xml = self.runner_xml.replace('<checkboxes>dog fish</checkboxes>', '<checkboxes>fish horse dog fish</checkboxes>')
+        runner = Runner(runner_xml, self.builder)
+
+        # Known choices, in the order of the items.
+        self.assertEqual(runner.form.checkboxes.choices_labels, ['Dog', 'Fish'])
+        self.assertEqual(runner.form.checkboxes.choices, {'Dog': 'dog', 'Fish': 'fish'})
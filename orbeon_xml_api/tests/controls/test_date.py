@@ -7,6 +7,7 @@ from lxml import etree
 
 from . import CommonTestCase
 from ..controls import DateControl
+from ... import controls
 
 
 class DateTestCase(CommonTestCase):
@@ -65,3 +66,35 @@ class DateTestCase(CommonTestCase):
         date_obj = datetime.strptime('2017-07-01', '%Y-%m-%d').date()
         self.assertEqual(self.runner.form.date.value, date_obj)
         self.assertEqual(self.runner.form.date.raw_value, '2017-07-01')
+
+    def test_decode_many(self):
+        el = etree.Element('test')
+        el.text = '2009-10-16'
+
+        date_obj = datetime.strptime('2009-10-16', '%Y-%m-%d').date()
+        self.assertEqual(self.control.decode_many([el, '2009-10-16', None]), [date_obj, date_obj, None])
+
+        # Invalid values, by decode()
+        self.assertEqual(self.control.decode_many(['2009-10-16', '2009-02-30', 'foo']),
+                         [date_obj, '2009-02-30 (!)', 'foo (!)'])
+
+        # Years numpy holds, but a date doesn't.
+        self.assertEqual(self.control.decode_many(['0000-01-01', '-001-01-01']),
+                         ['0000-01-01 (!)', '-001-01-01 (!)'])
+
+    def test_decode_many_no_numpy(self):
+        numpy = controls.numpy
+        try:
+            controls.numpy = None
+            date_obj = datetime.strptime('2009-10-16', '%Y-%m-%d').date()
+            self.assertEqual(self.control.decode_many(['2009-10-16', None]), [date_obj, None])
+        finally:
+            controls.numpy = numpy
+
+    def test_decode_array(self):
+        if controls.numpy is None:
+            self.skipTest('numpy is not installed')
+
+        values = self.control.decode_array(['2009-10-16', None])
+        self.assertEqual(values.dtype, controls.numpy.dtype('datetime64[D]'))
+        self.assertEqual(values.mask.tolist(), [False, True])
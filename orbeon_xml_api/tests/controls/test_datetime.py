@@ -2,11 +2,12 @@
 # Copyright 2017-2018 Bob Leers (http://www.novacode.nl)
 # See LICENSE file for full licensing details.
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from lxml import etree
 
 from . import CommonTestCase
 from ..controls import DateTimeControl
+from ... import controls
 
 
 class DateTimeTestCase(CommonTestCase):
@@ -26,6 +27,12 @@ class DateTimeTestCase(CommonTestCase):
         self.assertEqual(self.control.encode(dt_obj), '2017-07-01T17:48:03')
         self.assertEqual(self.control.decode(el), dt_obj)
 
+        el.text = '2017-07-01T17:48:03.500+02:00'
+        self.assertEqual(self.control.decode(el).isoformat(), '2017-07-01T17:48:03.500000+02:00')
+
+        el.text = '2017-07-01'
+        self.assertEqual(self.control.decode(el), '2017-07-01 (!)')
+
     def test_builder_bind(self):
         self.assertEqual(self.control._bind.id, 'datetime-bind')
         self.assertEqual(self.control._bind.name, 'datetime')
@@ -56,3 +63,20 @@ class DateTimeTestCase(CommonTestCase):
         dt_obj = datetime.strptime('2017-07-01T23:22:21', '%Y-%m-%dT%H:%M:%S')
         self.assertEqual(self.runner.form.datetime.value, dt_obj)
         self.assertEqual(self.runner.form.datetime.raw_value, '2017-07-01T23:22:21')
+
+    def test_decode_array(self):
+        if controls.numpy is None:
+            self.skipTest('numpy is not installed')
+
+        texts = ['2017-07-01T17:48:03.250+02:00', None, '2017-07-01T17:48:03']
+        values = self.control.decode_array(texts)
+        self.assertEqual(values.dtype, controls.numpy.dtype('datetime64[ms]'))
+        self.assertEqual(values.tolist(), [datetime(2017, 7, 1, 15, 48, 3, 250000), None,
+                                           datetime(2017, 7, 1, 17, 48, 3)])
+
+        # Not normalized (to UTC) by decode_many, alike decode().
+        self.assertEqual(self.control.decode_many(texts)[0].utcoffset(), timedelta(hours=2))
+
+        # Years numpy holds, but a datetime doesn't.
+        self.assertEqual(self.control.decode_many(['0000-01-01T00:00:00', '-001-01-01T00:00:00']),
+                         ['0000-01-01T00:00:00 (!)', '-001-01-01T00:00:00 (!)'])
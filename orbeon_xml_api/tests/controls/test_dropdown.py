@@ -3,7 +3,8 @@
 # See LICENSE file for full licensing details.
 
 from . import CommonTestCase
-from ..controls import Select1Control
+from ..controls import ChoiceIndex, Select1Control
+from ...builder import Resource
 
 
 class DropdownTestCase(CommonTestCase):
@@ -44,3 +45,21 @@ class DropdownTestCase(CommonTestCase):
         self.assertEqual(self.runner.form.dropdown.choice_value, 'bird')
         self.assertEqual(self.runner.form.dropdown.choice_label, 'Bird')
         self.assertEqual(self.runner.form.dropdown.choice, {'Bird': 'bird'})
+
+    def test_choice_index(self):
+        index = self.control._choice_index
+        self.assertEqual(index.get_label('bird'), 'Bird')
+        self.assertEqual(index.get_value('Bird'), 'bird')
+        self.assertIsNone(index.get_label('horse'))
+
+        # Per language
+        index_fr = self.builder.for_lang('fr').controls['dropdown']._choice_index
+        self.assertEqual(index_fr.get_label('bird'), 'Oiseau')
+        self.assertEqual(index_fr.get_value('Oiseau'), 'bird')
+
+    def test_choice_index_single_item(self):
+        resource = Resource(self.builder, {'label': 'One', 'item': {'label': 'Cat', 'value': 'cat'}})
+        index = ChoiceIndex(resource)
+        self.assertEqual(index.get_label('cat'), 'Cat')
+
+        self.assertEqual(ChoiceIndex(None).get_label('cat'), None)
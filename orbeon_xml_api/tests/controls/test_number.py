@@ -49,3 +49,14 @@ class NumberTestCase(CommonTestCase):
         self.assertEqual(self.runner.form.number.value, 19792017)
         self.assertEqual(self.runner.form.number.raw_value, '19792017')
         self.assertIsInstance(self.runner.form.number.value, int)
+
+    def test_decode_many(self):
+        values = self.control.decode_many(['12', None, '-3'])
+        self.assertEqual(values, [12, None, -3])
+        self.assertIsInstance(values[0], int)
+
+        # By decode(), which raises alike.
+        with self.assertRaises(ValueError):
+            self.control.decode_many(['12', '1.5'])
+
+        self.assertEqual(self.builder.controls['currency'].decode_many(['12.5', None]), [12.5, None])
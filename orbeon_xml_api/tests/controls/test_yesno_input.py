@@ -45,3 +45,6 @@ class YesnoInputTestCase(CommonTestCase):
         self.assertEqual(self.runner.form.yesnoinput.choice_label, 'Yes')
         self.assertEqual(self.runner.form.yesnoinput.choice_value, True)
         self.assertEqual(self.runner.form.yesnoinput.choice, {'Yes': True})
+
+    def test_decode_many(self):
+        self.assertEqual(self.control.decode_many(['true', 'false', None, 'foo']), [True, False, None, None])
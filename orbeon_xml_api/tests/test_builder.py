@@ -2,9 +2,14 @@
 # Copyright 2017-2018 Bob Leers (http://www.novacode.nl)
 # See LICENSE file for full licensing details.
 
+import mmap
+import os
+from lxml import etree
+
 from .test_common import CommonTestCase
-from ..builder import Bind
-from ..controls import Control
+from ..builder import Bind, Builder, BuilderIndex, LazyControls, LazyResource
+from ..controls import Control, DateControl
+from ..runner import Runner
 
 
 class BuilderTestCase(CommonTestCase):
@@ -18,3 +23,172 @@ class BuilderTestCase(CommonTestCase):
         for name, control in self.builder.controls.items():
             self.assertIn(name, self.control_names)
             self.assertIsInstance(control, Control)
+
+    def test_index(self):
+        index = self.builder.index
+        self.assertIsInstance(index, BuilderIndex)
+
+        # As by the (former) string queries
+        root = self.builder.xml_root
+        self.assertEqual(len(index.binds), len(self.bind_names))
+        self.assertEqual(index.binds, root.xpath(
+            "//*[@id='fr-form-binds']//*[name()='xforms:bind']|//*[@id='fr-form-binds']//*[name()='xf:bind']"))
+        self.assertEqual(index.fr_body_elements, root.xpath("//*[name()='fr:body']//*[@bind]"))
+
+        self.assertItemsEqual(index.resources.keys(), ['en', 'fr'])
+        self.assertEqual(index.resources['en'], root.xpath(
+            "//*[@id='fr-form-resources']/resources//resource[@xml:lang='en']"))
+        self.assertEqual(index.form_instance, root.xpath("//*[@id='fr-form-instance']/form//*"))
+
+        self.assertEqual([el.get('id') for el in index.fr_body_elements_by_bind['date-bind']], ['date-control'])
+        self.assertEqual(index.get_model_instance('date-time-controls', 'date').text, '2009-10-16')
+        self.assertIsNone(index.get_model_instance('text-controls', 'date'))
+
+    def test_bind_graph(self):
+        bind = self.builder.binds['date-bind']
+        parent = self.builder.binds['date-time-controls-bind']
+
+        self.assertIs(bind.parent, parent)
+        self.assertIs(parent.parent, None)
+        self.assertEqual(bind.get_ancestors(), [parent])
+        self.assertEqual(bind.children, [])
+
+        self.assertEqual([b.name for b in parent.children],
+                         ['date', 'time', 'datetime', 'dropdown-date', 'fields-date'])
+        self.assertEqual(list(parent.iter_descendants()), parent.children)
+
+        for child in parent.children:
+            self.assertIs(child, self.builder.binds[child.id])
+
+    def test_for_lang(self):
+        builder_fr = self.builder.for_lang('fr')
+
+        self.assertIsInstance(builder_fr, Builder)
+        self.assertIs(self.builder.for_lang('fr'), builder_fr)
+        self.assertIs(self.builder.for_lang('en'), self.builder)
+        self.assertIs(builder_fr.xml_root, self.builder.xml_root)
+        self.assertIs(builder_fr.binds, self.builder.binds)
+
+        self.assertEqual(builder_fr.lang, 'fr')
+        self.assertEqual(builder_fr.controls['dropdown'].label, u'Menu déroulant')
+        self.assertIs(builder_fr.controls['dropdown']._builder, builder_fr)
+        self.assertIs(builder_fr.controls['dropdown']._parent, builder_fr.controls['selection-controls'])
+        self.assertIsNone(builder_fr.controls['image-attachment'].label)
+
+        # Untouched
+        self.assertEqual(self.builder.controls['dropdown'].label, 'Dropdown Menu')
+
+    def test_fallback_langs(self):
+        builder_fr = self.builder.for_lang('fr', fallback_langs=['en'])
+        self.assertEqual(builder_fr.controls['dropdown'].label, u'Menu déroulant')
+        self.assertEqual(builder_fr.controls['image-attachment'].label, 'Image Attachment')
+
+        builder = Builder(self.builder_xml, 'de', fallback_langs=['fr', 'en'])
+        self.assertEqual(builder.controls['dropdown'].label, u'Menu déroulant')
+        self.assertEqual(builder.controls['image-attachment'].label, 'Image Attachment')
+
+    def test_lang_not_found(self):
+        with self.assertRaisesRegexp(Exception, "Found 0 elements for"):
+            Builder(self.builder_xml, 'de')
+
+    def test_from_file(self):
+        path = os.path.join(os.path.dirname(__file__), 'data', 'test_controls_builder_no-image-attachments-iteration.xml')
+
+        with open(path, 'rb') as f:
+            builder_by_file = Builder.from_file(f)
+
+        with open(path, 'rb') as f:
+            builder_by_mmap = Builder.from_file(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+        for builder in [Builder.from_file(path), builder_by_file, builder_by_mmap]:
+            self.assertItemsEqual(builder.controls.keys(), self.builder.controls.keys())
+            self.assertEqual(builder.controls['date'].label, 'Date')
+            self.assertEqual(builder.get_form_instance_element().tag, 'form')
+
+        # The XML is serialized on demand, not for the form instance.
+        builder = Builder.from_file(path)
+        builder.get_form_instance_raw()
+        builder.get_form_instance_element()
+        self.assertIsNone(builder._xml)
+        self.assertIn('fr-form-instance', builder_by_mmap.xml)
+
+    def test_element(self):
+        tree = etree.parse(os.path.join(os.path.dirname(__file__), 'data', 'test_controls_builder_no-image-attachments-iteration.xml'))
+
+        builder_copy = Builder(tree)
+        builder_owner = Builder(tree.getroot(), copy=False)
+
+        self.assertIsNot(builder_copy.xml_root, tree.getroot())
+        self.assertIs(builder_owner.xml_root, tree.getroot())
+
+        for builder in [builder_copy, builder_owner]:
+            self.assertItemsEqual(builder.controls.keys(), self.builder.controls.keys())
+            self.assertEqual(builder.controls['date'].label, 'Date')
+
+    def test_lazy(self):
+        builder = Builder(self.builder_xml, lazy=True)
+
+        self.assertIsInstance(builder.controls, LazyControls)
+        self.assertItemsEqual(builder.controls.keys(), self.builder.controls.keys())
+        self.assertIn('date', builder.controls)
+        self.assertNotIn('foo', builder.controls)
+        self.assertEqual(builder.controls.get_constructed(), [])
+
+        control = builder.controls['date']
+        self.assertIsInstance(control, DateControl)
+        self.assertEqual(control.label, 'Date')
+        self.assertEqual(control.default_raw_value, '2009-10-16')
+        self.assertIs(builder.controls['date'], control)
+
+        # With its parent
+        self.assertIs(control._parent, builder.controls['date-time-controls'])
+        self.assertItemsEqual(builder.controls.get_constructed(), ['date', 'date-time-controls'])
+
+        with self.assertRaises(KeyError):
+            builder.controls['foo']
+
+    def test_lazy_resource(self):
+        builder = Builder(self.builder_xml, 'fr', lazy=True, fallback_langs=['en'])
+        builder_eager = Builder(self.builder_xml, 'fr', fallback_langs=['en'])
+
+        self.assertIsInstance(builder.resource, LazyResource)
+        self.assertEqual(builder.resource._resource, {})
+        self.assertItemsEqual(builder.resource.keys(), builder_eager.resource.keys())
+
+        for tag, resource in builder_eager.resource.items():
+            self.assertEqual(builder.resource[tag].element, resource.element)
+
+    def test_lazy_same_as_eager(self):
+        builder = Builder(self.builder_xml, lazy=True)
+
+        for name, control in self.builder.controls.items():
+            lazy_control = builder.controls[name]
+            self.assertIs(lazy_control.__class__, control.__class__)
+            self.assertEqual(lazy_control.label, control.label)
+            self.assertEqual(lazy_control.hint, control.hint)
+            self.assertEqual(lazy_control._bind.name, control._bind.name)
+            self.assertEqual(lazy_control._raw_value, control._raw_value)
+
+        self.assertEqual(builder.sanitized_control_names, self.builder.sanitized_control_names)
+
+    def test_lazy_for_lang(self):
+        builder = Builder(self.builder_xml, lazy=True)
+        builder_fr = builder.for_lang('fr')
+
+        self.assertIsInstance(builder_fr.controls, LazyControls)
+        self.assertEqual(builder_fr.controls.get_constructed(), [])
+        self.assertEqual(builder_fr.controls['date'].label, self.builder.for_lang('fr').controls['date'].label)
+        self.assertEqual(builder.controls['date'].label, 'Date')
+
+        dropdown_fr = builder_fr.controls['dropdown']
+        self.assertIs(dropdown_fr._builder, builder_fr)
+        self.assertEqual(dropdown_fr.label, u'Menu déroulant')
+        self.assertEqual(dropdown_fr._choice_index.get_label('bird'), 'Oiseau')
+        self.assertEqual(builder.controls['dropdown'].label, 'Dropdown Menu')
+
+    def test_lazy_runner(self):
+        builder = Builder(self.builder_xml, lazy=True)
+        runner = Runner(self.runner_xml, builder)
+
+        self.assertEqual(runner.form.input.value, 'John')
+        self.assertEqual(runner.form.dropdown.choice_label, 'Bird')
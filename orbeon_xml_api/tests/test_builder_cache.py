@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2018 Bob Leers (http://www.novacode.nl)
+# See LICENSE file for full licensing details.
+
+import os
+import shutil
+import tempfile
+
+from .test_common import CommonTestCase
+from ..builder_cache import BuilderCache, builder_cache
+from ..builder_schema import BuilderSchema
+from ..runner import Runner
+from ..utils import xml_from_file
+
+
+class BuilderCacheTestCase(CommonTestCase):
+
+    def setUp(self):
+        super(BuilderCacheTestCase, self).setUp()
+        self.builder_2_xml = xml_from_file('tests/data', 'test_controls_builder_no-image-attachments-iteration_verion2.xml')
+        self.cache = BuilderCache(max_size=2)
+
+    def test_hit_miss(self):
+        schema = self.cache.get(self.builder_xml)
+        self.assertIsInstance(schema, BuilderSchema)
+        self.assertIs(self.cache.get(self.builder_xml), schema)
+
+        info = self.cache.get_info()
+        self.assertEqual(info['hits'], 1)
+        self.assertEqual(info['misses'], 1)
+        self.assertEqual(info['size'], 1)
+
+    def test_key_by_lang(self):
+        schema_en = self.cache.get(self.builder_xml, 'en')
+        schema_fr = self.cache.get(self.builder_xml, 'fr')
+
+        self.assertIsNot(schema_en, schema_fr)
+        self.assertEqual(schema_fr.lang, 'fr')
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_lru_eviction(self):
+        schema_en = self.cache.get(self.builder_xml, 'en')
+        self.cache.get(self.builder_2_xml, 'en')
+
+        # Refresh en, so builder_2 is the least recently used one.
+        self.cache.get(self.builder_xml, 'en')
+        self.cache.get(self.builder_xml, 'fr')
+
+        self.assertEqual(len(self.cache), 2)
+        self.assertIn(self.cache.get_key(self.builder_xml, 'en'), self.cache)
+        self.assertNotIn(self.cache.get_key(self.builder_2_xml, 'en'), self.cache)
+        self.assertIs(self.cache.get(self.builder_xml, 'en'), schema_en)
+
+    def test_max_bytes(self):
+        self.cache.set_max_bytes(len(self.builder_xml) + 1)
+        self.cache.get(self.builder_xml, 'en')
+        self.cache.get(self.builder_xml, 'fr')
+
+        self.assertEqual(len(self.cache), 1)
+        self.assertIn(self.cache.get_key(self.builder_xml, 'fr'), self.cache)
+        self.assertEqual(self.cache.get_info()['bytes'], len(self.builder_xml))
+
+    def test_runner_builder_xml(self):
+        misses = builder_cache.misses
+        runner_1 = Runner(self.runner_xml, None, self.builder_2_xml)
+        hits = builder_cache.hits
+        runner_2 = Runner(self.runner_xml, None, self.builder_2_xml)
+
+        self.assertIs(runner_1.builder, runner_2.builder)
+        self.assertLessEqual(builder_cache.misses, misses + 1)
+        self.assertEqual(builder_cache.hits, hits + 1)
+        self.assertEqual(runner_2.builder.controls['input-2'].label, 'Input Field 2')
+
+    def test_runner_builder_xml_schema(self):
+        runner = Runner(self.runner_xml, None, self.builder_xml)
+
+        # The Runner gets a (tree-free) BuilderSchema, not a Builder.
+        self.assertIsInstance(runner.builder, BuilderSchema)
+
+        for attr in ('controls', 'binds', 'resource', 'lang', 'sanitized_control_names', 'control_slots',
+                     'control_names', 'get_form_instance_raw', 'get_form_instance_element'):
+            self.assertTrue(hasattr(runner.builder, attr), attr)
+
+        for attr in ('xml', 'xml_root', 'index', 'fr_body_elements', 'form_instance', 'for_lang',
+                     'get_structure'):
+            self.assertFalse(hasattr(runner.builder, attr), attr)
+
+    def test_cache_dir(self):
+        cache_dir = tempfile.mkdtemp()
+
+        try:
+            cache = BuilderCache(cache_dir=cache_dir)
+            cache.get(self.builder_xml)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            self.assertEqual(cache.disk_hits, 0)
+
+            # A new process (cache) loads the saved schema.
+            cache = BuilderCache(cache_dir=cache_dir)
+            schema = cache.get(self.builder_xml)
+            self.assertEqual(cache.disk_hits, 1)
+            self.assertEqual(cache.misses, 1)
+            self.assertEqual(schema.controls['date'].label, 'Date')
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_cache_dir_save_error(self):
+        cache_dir = tempfile.mkdtemp()
+
+        try:
+            cache = BuilderCache(cache_dir=cache_dir)
+            # The rename (of the written file) onto a directory fails.
+            os.mkdir(cache.get_path(cache.get_key(self.builder_xml, 'en')))
+
+            runner = Runner(self.runner_xml, cache.get(self.builder_xml))
+            self.assertEqual(runner.form.input.value, 'John')
+            self.assertEqual(cache.get_info()['save_errors'], 1)
+            self.assertFalse([name for name in os.listdir(cache_dir) if name.endswith('.tmp')])
+
+            # Missing directory
+            cache = BuilderCache(cache_dir=os.path.join(cache_dir, 'foo'))
+            cache.get(self.builder_xml)
+            self.assertEqual(cache.save_errors, 1)
+            self.assertEqual(len(cache), 1)
+        finally:
+            shutil.rmtree(cache_dir)
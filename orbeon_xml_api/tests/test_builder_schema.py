@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2018 Bob Leers (http://www.novacode.nl)
+# See LICENSE file for full licensing details.
+
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from lxml import etree
+
+from .test_common import CommonTestCase
+from ..builder import Builder
+from ..builder_schema import BuilderSchema, FrozenElement
+from ..controls import DateControl
+from ..runner import Runner
+from ..utils import get_attrs
+
+
+class BuilderSchemaTestCase(CommonTestCase):
+
+    def setUp(self):
+        super(BuilderSchemaTestCase, self).setUp()
+        self.schema = self.builder.compile()
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        super(BuilderSchemaTestCase, self).tearDown()
+
+    def test_compile(self):
+        self.assertIsInstance(self.schema, BuilderSchema)
+        self.assertItemsEqual(self.schema.controls.keys(), self.builder.controls.keys())
+        self.assertItemsEqual(self.schema.binds.keys(), self.builder.binds.keys())
+
+    def test_from_xml(self):
+        schema = BuilderSchema.from_xml(self.builder_xml, 'en')
+        self.assertItemsEqual(schema.controls.keys(), self.builder.controls.keys())
+
+    def test_tree_free(self):
+        self.assertFalse(hasattr(self.schema, 'xml_root'))
+
+        for control in self.schema.controls.values():
+            self.assertIs(control._builder, self.schema)
+            self.assertIs(control._bind, self.schema.binds[control._bind.id])
+
+            for value in get_attrs(control).values():
+                self.assertNotIsInstance(value, etree._Element)
+
+    def test_immutable(self):
+        with self.assertRaisesRegexp(AttributeError, "BuilderSchema is immutable"):
+            self.schema.controls = {}
+
+        # Read-only mappings
+        for mapping in (self.schema.controls, self.schema.binds, self.schema.resource,
+                        self.schema.control_slots, self.schema.sanitized_control_names):
+            name = next(iter(mapping))
+            with self.assertRaises(TypeError):
+                mapping[name] = None
+            with self.assertRaises(TypeError):
+                del mapping[name]
+            self.assertFalse(hasattr(mapping, 'pop'))
+
+        with self.assertRaises(AttributeError):
+            self.schema.control_names.append('foo')
+
+    def test_control(self):
+        control = self.schema.controls['date']
+        date_obj = datetime.strptime('2009-10-16', '%Y-%m-%d').date()
+
+        self.assertIsInstance(control, DateControl)
+        self.assertEqual(control.label, 'Date')
+        self.assertEqual(control.hint, 'Standard date field')
+        self.assertEqual(control.default_raw_value, '2009-10-16')
+        self.assertEqual(control.default_value, date_obj)
+
+        self.assertIs(control._parent, self.schema.controls['date-time-controls'])
+        self.assertEqual(control._parent._resource_element.label, 'Date and Time')
+        self.assertIs(control._bind.parent, self.schema.binds['date-time-controls-bind'])
+        self.assertIn(control._bind, control._bind.parent.children)
+
+    def test_frozen_model_instance(self):
+        control = self.schema.controls['image-annotation']
+
+        self.assertIsInstance(control.default_raw_value, FrozenElement)
+        self.assertEqual([el.tag for el in control.default_raw_value], ['image', 'annotation'])
+        self.assertEqual(control.default_raw_value.getchildren()[0].get('mediatype'), 'image/png')
+
+    def test_runner(self):
+        runner = Runner(self.runner_xml, self.schema)
+
+        self.assertEqual(runner.form.input.label, 'Input Field')
+        self.assertEqual(runner.form.input.value, 'John')
+        self.assertEqual(runner.form.dropdown.choice_label, 'Bird')
+        self.assertEqual(runner.form.number.value, 19792017)
+
+    def test_runners_share_schema(self):
+        runner_1 = Runner(self.runner_xml, self.schema)
+        runner_2 = Runner(self.runner_xml.replace('<input>John', '<input>Jane'), self.schema)
+
+        self.assertEqual(runner_1.form.input.value, 'John')
+        self.assertEqual(runner_2.form.input.value, 'Jane')
+        self.assertFalse(hasattr(self.schema.controls['input'], 'value'))
+
+    def test_merge(self):
+        merged_runner = self.runner.merge(self.schema)
+
+        self.assertEqual(merged_runner.form.input.value, 'John')
+        self.assertIs(merged_runner.builder, self.schema)
+
+    def test_save_load(self):
+        path = os.path.join(self.tmp_dir, 'builder.schema')
+        self.builder.save(path)
+
+        schema = Builder.load(path, self.builder.get_key())
+        self.assertIsInstance(schema, BuilderSchema)
+        self.assertEqual(schema.key, self.builder.get_key())
+        self.assertItemsEqual(schema.controls.keys(), self.builder.controls.keys())
+        self.assertIs(schema.controls['date']._parent, schema.controls['date-time-controls'])
+
+        runner = Runner(self.runner_xml, schema)
+        self.assertEqual(runner.form.dropdown.choice_label, 'Bird')
+        self.assertEqual(runner.form.date.label, 'Date')
+
+    def test_load_wrong_key(self):
+        path = os.path.join(self.tmp_dir, 'builder.schema')
+        self.schema.save(path)
+
+        with self.assertRaisesRegexp(Exception, "Schema file has key"):
+            BuilderSchema.load(path, 'abc123')
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2018 Bob Leers (http://www.novacode.nl)
+# See LICENSE file for full licensing details.
+
+import unittest
+from datetime import date, datetime, timedelta
+from lxml import etree
+
+from ..builder import Builder
+from ..controls import DateControl
+from ..runner import Runner
+from ..utils import xml_from_file
+
+try:
+    import numpy
+    from .. import columnar
+except ImportError:
+    numpy = None
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class ColumnarTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(ColumnarTestCase, self).setUp()
+
+        self.builder_xml = xml_from_file('tests/data', 'test_controls_builder_no-image-attachments-iteration.xml')
+        self.runner_xml = xml_from_file('tests/data', 'test_controls_runner_no-image-attachments-iteration.xml')
+        self.builder = Builder(self.builder_xml)
+
+        self.docs = [
+            self.runner_xml,
+            self.runner_xml.replace('<input>John</input>', '<input>Jane</input>')
+                .replace('<checkboxes>dog fish</checkboxes>', '<checkboxes>cat</checkboxes>')
+                .replace('<dropdown>bird</dropdown>', '<dropdown/>'),
+            etree.fromstring(self.runner_xml.replace('<date>2017-07-01</date>', '<date>foo</date>')
+                             .replace('<number>19792017</number>', '<number/>')),
+        ]
+
+    def test_extract(self):
+        columns = columnar.extract(self.builder, self.docs)
+        runner = Runner(self.runner_xml, self.builder)
+
+        # The same fields as the Runner values.
+        self.assertItemsEqual(columns.keys(), runner.values.keys())
+        for column in columns.values():
+            self.assertEqual(len(column), len(self.docs))
+
+    def test_typed(self):
+        columns = columnar.extract(self.builder, self.docs, fields=['date', 'number', 'currency', 'yesno-input'])
+
+        self.assertEqual(columns['date'].kind, columnar.TYPED)
+        self.assertEqual(columns['date'].values.dtype, numpy.dtype('datetime64[D]'))
+        # An invalid value is masked.
+        self.assertEqual(columns['date'].values.tolist(), [date(2017, 7, 1), date(2017, 7, 1), None])
+
+        self.assertEqual(columns['number'].values.dtype, numpy.int64)
+        self.assertEqual(columns['number'].values.tolist(), [19792017, 19792017, None])
+        self.assertEqual(columns['currency'].values.dtype, numpy.float64)
+        self.assertEqual(columns['yesno-input'].values.dtype, numpy.bool_)
+
+    def test_typed_invalid(self):
+        texts = ['2017-07-01', 'foo', '0000-01-01', None, '2017-02-30', '2017-07-02']
+        docs = [self.runner_xml.replace('<date>2017-07-01</date>', '<date>%s</date>' % text if text else '<date/>')
+                for text in texts]
+
+        decode_array = DateControl.decode_array
+        calls = []
+
+        def counted_decode_array(control, texts, utc=True):
+            calls.append(len(texts))
+            return decode_array(control, texts, utc)
+
+        try:
+            DateControl.decode_array = counted_decode_array
+            columns = columnar.extract(self.builder, docs, fields=['date'])
+        finally:
+            DateControl.decode_array = decode_array
+
+        self.assertEqual(columns['date'].values.tolist(),
+                         [date(2017, 7, 1), None, None, None, None, date(2017, 7, 2)])
+        # Vectorized (rejected), and once on the valid values; not per value.
+        self.assertEqual(calls, [len(texts), len(texts)])
+
+    def test_typed_timezone(self):
+        docs = [
+            self.runner_xml.replace('<datetime>2017-07-01T23:22:21</datetime>',
+                                    '<datetime>2017-07-01T17:48:03.250+02:00</datetime>')
+                .replace('<date>2017-07-01</date>', '<date>2017-07-01Z</date>'),
+            self.runner_xml,
+        ]
+        columns = columnar.extract(self.builder, docs, fields=['datetime', 'date'])
+
+        # Normalized to UTC, in the unit of the fractional seconds.
+        self.assertEqual(columns['datetime'].values.dtype, numpy.dtype('datetime64[ms]'))
+        self.assertEqual(columns['datetime'].values.tolist(), [
+            datetime(2017, 7, 1, 15, 48, 3, 250000),
+            datetime(2017, 7, 1, 23, 22, 21),
+        ])
+        self.assertEqual(columns['date'].values.tolist(), [date(2017, 7, 1), date(2017, 7, 1)])
+
+        # As decoded by the Runner.
+        runner = Runner(docs[0], self.builder)
+        self.assertEqual(runner.values['datetime'].utcoffset(), timedelta(hours=2))
+
+    def test_category(self):
+        columns = columnar.extract(self.builder, self.docs, fields=['input', 'dropdown'])
+
+        self.assertEqual(columns['input'].kind, columnar.CATEGORY)
+        self.assertEqual(columns['input'].categories, ['John', 'Jane'])
+        self.assertEqual(columns['input'].values.tolist(), [0, 1, 0])
+        self.assertIsNone(columns['input'].labels)
+
+        self.assertEqual(columns['dropdown'].categories, ['bird'])
+        self.assertEqual(columns['dropdown'].labels, ['Bird'])
+        self.assertEqual(columns['dropdown'].values.tolist(), [0, -1, 0])
+
+    def test_choices(self):
+        column = columnar.extract(self.builder, self.docs, fields=['checkboxes'])['checkboxes']
+
+        self.assertEqual(column.kind, columnar.CHOICES)
+        self.assertEqual(column.categories, ['cat', 'dog', 'bird', 'fish'])
+        self.assertEqual(column.labels, ['Cat', 'Dog', 'Bird', 'Fish'])
+        self.assertEqual(column.values.tolist(), [
+            [False, True, False, True],
+            [True, False, False, False],
+            [False, True, False, True],
+        ])
+
+    def test_object(self):
+        builder = Builder(self.builder_xml, controls={'DateControl': MyDateControl})
+        columns = columnar.extract(builder, self.docs, fields=['time', 'date'])
+
+        self.assertEqual(columns['time'].kind, columnar.OBJECT)
+        self.assertEqual(columns['time'].values.tolist(), [Runner(self.runner_xml, builder).values['time']] * 3)
+
+        # By the decode() of a custom Control class.
+        self.assertEqual(columns['date'].kind, columnar.OBJECT)
+        self.assertEqual(columns['date'].values.tolist(), ['2017-07-01 decoded', '2017-07-01 decoded', 'foo decoded'])
+
+    def test_fields_section(self):
+        columns = columnar.extract(self.builder, self.docs, fields=['date-time-controls'])
+        self.assertItemsEqual(columns.keys(), ['date', 'time', 'datetime', 'dropdown-date', 'fields-date'])
+
+    def test_invalid_doc(self):
+        with self.assertRaisesRegexp(Exception, "No \\(valid\\) Runner XML, document 1"):
+            columnar.extract(self.builder, [self.runner_xml, 'foo'])
+
+
+class MyDateControl(DateControl):
+
+    def decode(self, element):
+        return '%s decoded' % element.text
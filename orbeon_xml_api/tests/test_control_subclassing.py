@@ -43,6 +43,31 @@ class ControlDecoderTestCase(unittest.TestCase):
         date_obj_add_10_days = datetime.strptime('2017-07-11', '%Y-%m-%d').date()
         self.assertEqual(self.runner.form.date.value, date_obj_add_10_days)
 
+    def test_decode_many(self):
+        controls = {
+            'DateControl': MyDateControl
+        }
+        self.builder = Builder(self.builder_xml, 'en', controls=controls)
+        control = self.builder.controls['date']
+
+        # The (overridden) decode, not the vectorized decode_array.
+        self.assertFalse(control.has_decode_array())
+        date_obj_add_10_days = datetime.strptime('2017-07-11', '%Y-%m-%d').date()
+        self.assertEqual(control.decode_many(['2017-07-01']), [date_obj_add_10_days])
+
+    def test_slots(self):
+        controls = {
+            'StringControl': MyStringControl
+        }
+        self.builder = Builder(self.builder_xml, 'en', controls=controls)
+
+        # Builtin Controls have (only) slots, a subclass without __slots__
+        # can still set its own attributes.
+        self.assertFalse(hasattr(self.builder.controls['date'], '__dict__'))
+        self.assertFalse(hasattr(self.builder.binds['date-bind'], '__dict__'))
+        self.assertEqual(self.builder.controls['input'].username, 'novacode')
+        self.assertEqual(self.builder.controls['input'].label, 'Input Field')
+
     def test_my_image_annotation_control(self):
         controls = {
             'ImageAnnotationControl': MyImageAnnotationControl
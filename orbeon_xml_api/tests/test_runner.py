@@ -2,10 +2,18 @@
 # Copyright 2017-2018 Bob Leers (http://www.novacode.nl)
 # See LICENSE file for full licensing details.
 
+import mmap
+import os
+import tempfile
+import threading
+from io import BytesIO
+from lxml import etree
 from xmlunittest import XmlTestCase
 
 from .test_common import CommonTestCase
-from ..runner import Runner, RunnerForm
+from ..builder import Builder
+from ..controls import get_text_element, AnyUriControl, DateControl, ImageAnnotationControl
+from ..runner import Runner, RunnerControls, RunnerForm, RunnerSlots, RunnerValues
 from ..utils import xml_from_file
 
 
@@ -33,3 +41,237 @@ class RunnerTestCase(CommonTestCase, XmlTestCase):
 
         with self.assertRaisesRegexp(Exception, "Constructor accepts either builder or builder_xml."):
             Runner(self.runner_xml, self.builder, self.builder_xml)
+
+    def test_from_stream(self):
+        runner = Runner.from_stream(BytesIO(self.runner_xml), self.builder)
+
+        self.assertEqual(runner.values, self.runner.values)
+        self.assertEqual(runner.form.input.value, 'John')
+        self.assertEqual(runner.form.dropdown.choice_label, 'Bird')
+
+        # The us-address (sub)fields are no controls of the Builder.
+        self.assertEqual(len(self.runner.xml_root.xpath('//street-name')), 1)
+        self.assertEqual(len(runner.xml_root.xpath('//street-name')), 0)
+
+    def test_from_stream_builder_xml(self):
+        fd, path = tempfile.mkstemp(suffix='.xml')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.runner_xml)
+            runner = Runner.from_stream(path, builder_xml=self.builder_xml)
+        finally:
+            os.remove(path)
+
+        self.assertEqual(runner.values, self.runner.values)
+
+    def test_from_stream_envelope(self):
+        xml = self.runner_xml.split('?>', 1)[-1]
+        envelope = '<envelope><attachment>%s</attachment>%s<trailer>x</trailer></envelope>' % ('A' * 100000, xml)
+        runner = Runner.from_stream(BytesIO(envelope), self.builder)
+
+        self.assertEqual(runner.values, self.runner.values)
+        self.assertEqual([el.tag for el in runner.xml_root], ['form'])
+
+    def test_from_stream_no_form(self):
+        with self.assertRaisesRegexp(Exception, "No form element"):
+            Runner.from_stream(BytesIO('<envelope/>'), self.builder)
+
+    def test_from_file(self):
+        fd, path = tempfile.mkstemp(suffix='.xml')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.runner_xml)
+
+            runner_by_path = Runner.from_file(path, self.builder)
+
+            with open(path, 'rb') as f:
+                runner_by_file = Runner.from_file(f, None, self.builder_xml)
+
+            with open(path, 'rb') as f:
+                runner_by_mmap = Runner.from_file(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), self.builder)
+        finally:
+            os.remove(path)
+
+        for runner in [runner_by_path, runner_by_file, runner_by_mmap]:
+            self.assertEqual(runner.values, self.runner.values)
+            self.assertEqual(runner.form.input.value, 'John')
+
+    def test_element(self):
+        runner_copy = Runner(etree.ElementTree(etree.fromstring(self.runner_xml)), self.builder)
+        self.assertEqual(runner_copy.values, self.runner.values)
+
+        # The form of an envelope (document).
+        envelope = etree.Element('envelope')
+        etree.SubElement(envelope, 'form')
+        envelope.append(etree.fromstring(self.runner_xml))
+
+        runner_owner = Runner(envelope[1], self.builder, copy=False)
+        self.assertIs(runner_owner.xml_root, envelope[1])
+        self.assertEqual(runner_owner.values, self.runner.values)
+        self.assertTrue(runner_owner.xml.startswith('<form>'))
+
+    def test_decode_once(self):
+        builder = Builder(self.builder_xml, controls={'DateControl': CountingDateControl})
+        CountingDateControl.decoded = []
+
+        runner = Runner(self.runner_xml, builder)
+        self.assertEqual(runner.form.date.value, runner.values['date'])
+        self.assertEqual(CountingDateControl.decoded.count(('date', '2017-07-01')), 1)
+
+    def test_lazy(self):
+        builder = Builder(self.builder_xml, controls={'DateControl': CountingDateControl})
+        CountingDateControl.decoded = []
+
+        runner = Runner(self.runner_xml, builder, lazy=True)
+        self.assertIsInstance(runner.values, RunnerValues)
+        self.assertIsInstance(runner.controls, RunnerControls)
+        self.assertItemsEqual(runner.values.keys(), self.runner.values.keys())
+        self.assertIn('date', runner.values)
+        self.assertEqual(CountingDateControl.decoded, [])
+
+        date = runner.get_value('date')
+        self.assertEqual(runner.form.date.value, date)
+        self.assertEqual(runner.values['date'], date)
+        self.assertEqual(CountingDateControl.decoded, [('date', '2017-07-01')])
+
+        # The Builder control isn't changed.
+        self.assertFalse(hasattr(builder.controls['date'], 'value'))
+
+    def test_lazy_builder(self):
+        builder = Builder(self.builder_xml, lazy=True)
+        runner = Runner(self.runner_xml, builder, lazy=True)
+
+        # No Builder control is constructed, until a value is read.
+        self.assertItemsEqual(runner.values.keys(), self.runner.values.keys())
+        self.assertEqual(builder.controls.get_constructed(), [])
+
+        # The control, and its parent (section) control.
+        self.assertEqual(runner.get_value('input'), 'John')
+        self.assertItemsEqual(builder.controls.get_constructed(), ['input', 'text-controls'])
+
+        runner = Runner.from_stream(BytesIO(self.runner_xml), builder, fields=['date'], lazy=True)
+        self.assertEqual(runner.values.keys(), ['date'])
+        self.assertItemsEqual(builder.controls.get_constructed(), ['input', 'text-controls'])
+
+    def test_lazy_same_as_eager(self):
+        runner = Runner(self.runner_xml, self.builder, lazy=True)
+
+        self.assertEqual(dict(runner.values), self.runner.values)
+        self.assertEqual(runner.form.dropdown.choice_label, 'Bird')
+        self.assertEqual(runner.form.checkboxes.choices_labels, self.runner.form.checkboxes.choices_labels)
+        self.assertEqual(runner.form.number.value, 19792017)
+
+    def test_fields(self):
+        runner = Runner(self.runner_xml, self.builder, fields=['input', 'date-time-controls'])
+
+        self.assertItemsEqual(runner.values.keys(), ['input', 'date', 'time', 'datetime', 'dropdown-date', 'fields-date'])
+        self.assertEqual(runner.form.input.value, 'John')
+        self.assertEqual(runner.form.date.value, self.runner.form.date.value)
+        self.assertIsNone(runner.form.dropdown)
+        self.assertIsNone(runner.get_form_control('number'))
+
+    def test_fields_lazy(self):
+        builder = Builder(self.builder_xml, lazy=True)
+        runner = Runner(self.runner_xml, builder, fields=['dropdown'], lazy=True)
+
+        self.assertEqual(runner.values.keys(), ['dropdown'])
+        self.assertEqual(runner.form.dropdown.choice_label, 'Bird')
+        self.assertIsNone(runner.form.input)
+        self.assertNotIn('input', builder.controls.get_constructed())
+
+    def test_fields_stream(self):
+        runner = Runner.from_stream(BytesIO(self.runner_xml), self.builder, fields=['number', 'email'])
+
+        self.assertItemsEqual(runner.values.keys(), ['number', 'email'])
+        self.assertEqual(runner.form.number.value, 19792017)
+        self.assertEqual(len(runner.xml_root.xpath('//form/*/*')), 2)
+
+    def test_fields_unknown(self):
+        with self.assertRaisesRegexp(Exception, "Unknown field: foo"):
+            Runner(self.runner_xml, self.builder, fields=['foo'])
+
+    def test_slots(self):
+        runner = Runner(self.runner_xml, self.builder)
+        slot = self.builder.control_slots['input']
+
+        self.assertEqual(self.builder.control_names[slot], 'input')
+        self.assertIsInstance(runner.values, RunnerSlots)
+        self.assertEqual(runner._values[slot], 'John')
+        self.assertIs(runner.controls['input'], runner._controls[slot])
+        self.assertIs(runner.raw_values['input'], runner._raw_values[slot])
+
+        # Only the controls in the Runner form are keys.
+        self.assertEqual(len(runner.values), len(runner.values.keys()))
+        self.assertNotIn('foo', runner.values)
+        with self.assertRaises(KeyError):
+            runner.values['foo']
+
+        runner = Runner(self.runner_xml, self.builder, fields=['dropdown'])
+        self.assertEqual(runner.values.keys(), ['dropdown'])
+        self.assertNotIn('input', runner.values)
+        self.assertIsNone(runner.form.input)
+
+    def test_decode_many(self):
+        runner = Runner(self.runner_xml, self.builder)
+        control_types = set()
+
+        for name, element in runner.raw_values.items():
+            control = self.builder.controls[name]
+            control_types.add(type(control))
+
+            self.assertEqual(control.decode_many([element]), [control.decode(element)], name)
+
+            # A text decodes as an element of that text only (no attributes
+            # or children).
+            text_element = get_text_element(name, element.text)
+            self.assertEqual(control.decode_many([element.text]), [control.decode(text_element)], name)
+            if not len(element) and not element.attrib:
+                self.assertEqual(control.decode_many([element.text]), [control.decode(element)], name)
+
+        self.assertIn(AnyUriControl, control_types)
+        self.assertIn(ImageAnnotationControl, control_types)
+
+    def test_slots_document_order(self):
+        self.assertEqual(self.builder.control_names[:3], ['text-controls', 'input', 'input-counter'])
+        self.assertEqual(Builder(self.builder_xml, lazy=True).control_names, self.builder.control_names)
+
+    def test_runners_share_builder(self):
+        runner_1 = Runner(self.runner_xml, self.builder)
+        runner_2 = Runner(self.runner_xml.replace('<input>John', '<input>Jane'), self.builder)
+
+        self.assertEqual(runner_1.form.input.value, 'John')
+        self.assertEqual(runner_2.form.input.value, 'Jane')
+        self.assertEqual(runner_2.form.input.label, 'Input Field')
+
+        control = self.builder.controls['input']
+        self.assertFalse(hasattr(control, 'value'))
+        self.assertIsNot(runner_1.controls['input'], control)
+        self.assertIs(runner_1.controls['input']._builder_control, control)
+        self.assertIsInstance(runner_1.controls['input'], control.__class__)
+
+    def test_concurrent_runners(self):
+        names = ['John', 'Jane', 'Joe', 'Jill']
+        results = {}
+
+        def run(name):
+            for i in range(20):
+                runner = Runner(self.runner_xml.replace('<input>John', '<input>%s' % name), self.builder)
+                results.setdefault(name, set()).add(runner.form.input.value)
+
+        threads = [threading.Thread(target=run, args=(name,)) for name in names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for name in names:
+            self.assertEqual(results[name], set([name]))
+
+
+class CountingDateControl(DateControl):
+
+    decoded = []
+
+    def decode(self, element):
+        CountingDateControl.decoded.append((getattr(element, 'tag', None), getattr(element, 'text', None)))
+        return super(CountingDateControl, self).decode(element)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2018 Bob Leers (http://www.novacode.nl)
+# See LICENSE file for full licensing details.
+
+from .test_common import CommonTestCase
+from .. import runner_bulk_merge
+from ..builder import Builder
+from ..runner import Runner
+from ..runner_bulk_merge import BulkMergeResult, RunnerBulkMerge
+from ..runner_copy_builder_merge import RunnerCopyBuilderMerge
+from ..utils import xml_from_file
+
+
+def failing_merge_chunk(chunk, plan=None):
+    raise RuntimeError("Worker failure")
+
+
+def failing_merge_plan(*args, **kwargs):
+    raise RuntimeError("No plan")
+
+
+class RunnerBulkMergeTestCase(CommonTestCase):
+
+    def setUp(self):
+        super(RunnerBulkMergeTestCase, self).setUp()
+
+        self.runner_xml = xml_from_file('tests/data', 'test_controls_runner_no-image-attachments-iteration.xml')
+        self.builder_1_xml = xml_from_file('tests/data', 'test_controls_builder_no-image-attachments-iteration.xml')
+        self.builder_2_xml = xml_from_file('tests/data', 'test_controls_builder_no-image-attachments-iteration_verion2.xml')
+
+        self.builder_1 = Builder(self.builder_1_xml)
+        self.builder_2 = Builder(self.builder_2_xml)
+
+        names = ['John', 'Jane', 'Joe', 'Jill', 'Jack']
+        self.runner_xmls = [self.runner_xml.replace('<input>John', '<input>%s' % n) for n in names]
+        self.names = names
+
+    def _assert_results(self, results):
+        self.assertEqual(len(results), len(self.names))
+
+        for result in results:
+            self.assertIsInstance(result, BulkMergeResult)
+            self.assertIsNone(result.error)
+
+            runner = Runner(result.xml, self.builder_2)
+            self.assertEqual(runner.values['input'], self.names[result.index])
+            self.assertIn('input-2', runner.values)
+
+    def test_merge_inline(self):
+        bulk = RunnerBulkMerge(self.builder_2, self.builder_1, processes=0)
+        results = list(bulk.merge(self.runner_xmls))
+
+        self.assertEqual([r.index for r in results], range(len(self.names)))
+        self._assert_results(results)
+
+        runner = Runner(self.runner_xml, self.builder_1)
+        merged_runner = RunnerCopyBuilderMerge(runner, self.builder_2).merge()
+        self.assertEqual(results[0].xml, merged_runner.xml)
+
+    def test_merge_ordered(self):
+        bulk = RunnerBulkMerge(self.builder_2, processes=2, chunksize=2, max_pending=1)
+        results = list(bulk.merge(iter(self.runner_xmls)))
+
+        self.assertEqual([r.index for r in results], range(len(self.names)))
+        self._assert_results(results)
+
+    def test_merge_unordered(self):
+        bulk = RunnerBulkMerge(self.builder_2.compile(), processes=2, chunksize=1, ordered=False)
+        results = list(bulk.merge(self.runner_xmls))
+
+        self.assertItemsEqual([r.index for r in results], range(len(self.names)))
+        self._assert_results(results)
+
+    def test_merge_no_copy(self):
+        bulk = RunnerBulkMerge(self.builder_2, processes=0, no_copy_prefix='NC.')
+        result = next(bulk.merge(self.runner_xmls))
+
+        runner = Runner(result.xml, self.builder_2)
+        self.assertEqual(runner.values['NC.no-copy-field'], None)
+
+    def test_merge_errors(self):
+        bulk = RunnerBulkMerge(self.builder_2, processes=2, chunksize=2)
+        results = list(bulk.merge([self.runner_xml, '', 'no xml', self.runner_xml]))
+
+        self.assertEqual([r.index for r in results], [0, 1, 2, 3])
+        self.assertIsNone(results[0].error)
+        self.assertIsNone(results[1].xml)
+        self.assertIn('XMLSyntaxError', results[1].error)
+        self.assertIn('No (valid) Runner XML', results[2].error)
+        self.assertIsNone(results[3].error)
+
+    def test_merge_stop_early(self):
+        bulk = RunnerBulkMerge(self.builder_2, processes=2, chunksize=1, max_pending=2)
+        results = bulk.merge(self.runner_xmls * 10)
+
+        self.assertEqual(next(results).index, 0)
+        self.assertEqual(next(results).index, 1)
+        results.close()
+
+    def test_merge_unordered_task_error(self):
+        # Not a per document error, but a failed task (fork inherits the
+        # patched module).
+        merge_chunk = runner_bulk_merge.merge_chunk
+        try:
+            runner_bulk_merge.merge_chunk = failing_merge_chunk
+            bulk = RunnerBulkMerge(self.builder_2, processes=2, chunksize=1, ordered=False)
+
+            with self.assertRaisesRegexp(RuntimeError, "Worker failure"):
+                list(bulk.merge(self.runner_xmls))
+        finally:
+            runner_bulk_merge.merge_chunk = merge_chunk
+
+    def test_merge_worker_init_error(self):
+        merge_plan = runner_bulk_merge.MergePlan
+        try:
+            runner_bulk_merge.MergePlan = failing_merge_plan
+            bulk = RunnerBulkMerge(self.builder_2, processes=2, chunksize=2, ordered=False)
+            results = list(bulk.merge(self.runner_xmls))
+        finally:
+            runner_bulk_merge.MergePlan = merge_plan
+
+        self.assertItemsEqual([r.index for r in results], range(len(self.names)))
+        self.assertEqual(set(r.error for r in results), set(['RuntimeError: No plan']))
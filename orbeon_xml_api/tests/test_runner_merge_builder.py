@@ -2,12 +2,13 @@
 # Copyright 2017-2018 Bob Leers (http://www.novacode.nl)
 # See LICENSE file for full licensing details.
 
+from lxml import etree
 from xmlunittest import XmlTestCase
 
 from .test_common import CommonTestCase
 from ..builder import Builder
 from ..runner import Runner
-from ..runner_copy_builder_merge import RunnerCopyBuilderMerge
+from ..runner_copy_builder_merge import MergePlan, RunnerCopyBuilderMerge
 from ..utils import xml_from_file
 
 
@@ -63,3 +64,50 @@ class RunnerBuilderMergeTestCase(CommonTestCase, XmlTestCase):
         merged_runner = merger.merge()
 
         self.assertEqual(merged_runner.form.NC_nocopyfield.value, None)
+
+    def test_merge_in_memory(self):
+        merged_runner = self.runner.merge(self.builder_2)
+
+        # Built from the merged tree, which is serialized on demand.
+        self.assertEqual(merged_runner.xml_root.tag, 'form')
+        self.assertEqual(merged_runner.xml, etree.tostring(merged_runner.xml_root))
+        self.assertEqual(merged_runner.form.input.value, 'John')
+
+    def test_merge_repeatable(self):
+        merged_runner_1 = self.runner.merge(self.builder_2)
+        merged_runner_2 = self.runner.merge(self.builder_2, no_copy_prefix='NC.')
+        merged_runner_3 = self.runner.merge(self.builder_2)
+
+        # The Builder form instance isn't changed by a merge.
+        self.assertEqual(merged_runner_2.values['NC.no-copy-field'], None)
+        self.assertEqual(merged_runner_1.xml, merged_runner_3.xml)
+
+    def test_merge_plan(self):
+        plan = MergePlan.compile(self.runner.builder, self.builder_2, no_copy_prefix='NC.')
+
+        self.assertEqual(plan.added, ['input-2'])
+        self.assertEqual(plan.removed, [])
+        self.assertIn('NC.no-copy-field', plan.excluded)
+        self.assertIn('image', plan.excluded)
+        self.assertNotIn('input-2', [tag for position, tag in plan.copied])
+
+        merged_runner = plan.apply(self.runner)
+        self.assertEqual(merged_runner.form.input.value, 'John')
+        self.assertEqual(merged_runner.values['NC.no-copy-field'], None)
+
+        merger = RunnerCopyBuilderMerge(self.runner, self.builder_2, no_copy_prefix='NC.')
+        self.assertEqual(merged_runner.xml, merger.merge().xml)
+
+    def test_merge_plan_many_runners(self):
+        plan = MergePlan.compile(self.runner.builder, self.builder_2)
+        runner_2 = Runner(self.runner_xml.replace('<input>John', '<input>Jane'), self.runner.builder)
+
+        merged_runner_1 = plan.apply(self.runner)
+        merged_runner_2 = plan.apply(runner_2)
+
+        self.assertEqual(merged_runner_1.values['input'], 'John')
+        self.assertEqual(merged_runner_2.values['input'], 'Jane')
+
+    def test_merge_plan_removed(self):
+        plan = MergePlan.compile(self.builder_2, self.runner.builder)
+        self.assertEqual(plan.removed, ['input-2'])
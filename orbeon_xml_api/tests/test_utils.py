@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2018 Bob Leers (http://www.novacode.nl)
+# See LICENSE file for full licensing details.
+
+import mmap
+import tempfile
+import threading
+import unittest
+import xmltodict
+from lxml import etree
+
+from ..builder import Builder
+from ..runner import Runner
+from .. import utils
+from datetime import date, datetime, time, timedelta
+
+from ..utils import etree_to_xmltodict, generate_xml_root, get_parse_stats, get_parser, parse_iso_date, \
+    parse_iso_datetime, parse_iso_time, parse_xml_file, reset_parse_stats, xml_from_file, PARSE_RECOVER, \
+    PARSE_STRICT, PARSE_STRICT_THEN_RECOVER
+
+
+class EtreeToXmltodictTestCase(unittest.TestCase):
+
+    def assertSameAsXmltodict(self, xml):
+        expected = xmltodict.parse(xml).values()[0]
+        self.assertEqual(etree_to_xmltodict(etree.XML(xml)), expected)
+
+    def test_text(self):
+        self.assertSameAsXmltodict('<label>Date</label>')
+        self.assertSameAsXmltodict('<label>  Date\n</label>')
+        self.assertSameAsXmltodict('<hint/>')
+        self.assertSameAsXmltodict('<hint>   </hint>')
+
+    def test_children(self):
+        self.assertSameAsXmltodict(
+            '<dropdown><label>Dropdown</label><hint/>'
+            '<item><label>Cat</label><value>cat</value></item>'
+            '<item><label>Dog</label><value>dog</value></item></dropdown>')
+        self.assertSameAsXmltodict('<dropdown><item><label>Cat</label><value>cat</value></item></dropdown>')
+
+    def test_attributes_and_mixed_text(self):
+        self.assertSameAsXmltodict('<a x="1" xml:lang="en">t<b>1</b>u<!-- comment -->v<c y="2"/></a>')
+        self.assertSameAsXmltodict('<a><![CDATA[<b>html</b>]]></a>')
+
+    def test_resource(self):
+        resource = etree.XML(
+            '<resource xml:lang="en"><date><label>Date</label><hint>Standard date field</hint></date></resource>')
+
+        self.assertEqual(etree_to_xmltodict(resource[0]), {'label': 'Date', 'hint': 'Standard date field'})
+        self.assertEqual(etree_to_xmltodict(resource)['@xml:lang'], 'en')
+
+
+class GenerateXmlRootTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(GenerateXmlRootTestCase, self).setUp()
+        reset_parse_stats()
+
+    def test_strict(self):
+        root = generate_xml_root('<form><a>x</a></form>', PARSE_STRICT)
+        self.assertEqual(root[0].text, 'x')
+
+        with self.assertRaises(etree.XMLSyntaxError):
+            generate_xml_root('<form><a>x</form>', PARSE_STRICT)
+
+    def test_recover(self):
+        root = generate_xml_root('<form><a>x</form>', PARSE_RECOVER)
+        self.assertEqual(root[0].text, 'x')
+        self.assertEqual(get_parse_stats()['parses'], 0)
+
+    def test_strict_then_recover(self):
+        generate_xml_root('<form><a>x</a></form>')
+        root = generate_xml_root('<form><a>x</form>', PARSE_STRICT_THEN_RECOVER)
+        generate_xml_root('<form/>')
+
+        self.assertEqual(root[0].text, 'x')
+        self.assertEqual(get_parse_stats(), {'parses': 3, 'recovered': 1})
+
+        reset_parse_stats()
+        self.assertEqual(get_parse_stats(), {'parses': 0, 'recovered': 0})
+
+    def test_same_as_strict(self):
+        xml = xml_from_file('tests/data', 'test_controls_builder_no-image-attachments-iteration.xml')
+        self.assertEqual(
+            etree.tostring(generate_xml_root(xml, PARSE_STRICT_THEN_RECOVER)),
+            etree.tostring(generate_xml_root(xml, PARSE_STRICT)))
+
+    def test_unknown_policy(self):
+        with self.assertRaisesRegexp(Exception, "Unknown parse policy: lenient"):
+            generate_xml_root('<form/>', 'lenient')
+
+    def test_parser_per_thread(self):
+        parsers = []
+        thread = threading.Thread(target=lambda: parsers.append(get_parser()))
+        thread.start()
+        thread.join()
+
+        self.assertIs(get_parser(), get_parser())
+        self.assertIsNot(parsers[0], get_parser())
+        self.assertIsNot(get_parser(recover=True), get_parser())
+
+    def test_parse_policy_kwarg(self):
+        runner_xml = '<form><section><input>x</section></form>'
+        builder_xml = xml_from_file('tests/data', 'test_controls_builder_no-image-attachments-iteration.xml')
+        builder = Builder(builder_xml, parse_policy=PARSE_STRICT)
+
+        with self.assertRaises(etree.XMLSyntaxError):
+            Runner(runner_xml, builder, parse_policy=PARSE_STRICT)
+
+        Runner(runner_xml, builder)
+        self.assertEqual(get_parse_stats()['recovered'], 1)
+
+
+class ParseXmlFileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(ParseXmlFileTestCase, self).setUp()
+        reset_parse_stats()
+
+        self.xml = xml_from_file('tests/data', 'test_controls_runner_no-image-attachments-iteration.xml')
+        self.tmp_file = tempfile.TemporaryFile()
+        self.tmp_file.write(self.xml)
+        self.tmp_file.flush()
+
+        self.feed_chunk_size = utils.FEED_CHUNK_SIZE
+
+    def tearDown(self):
+        utils.FEED_CHUNK_SIZE = self.feed_chunk_size
+        self.tmp_file.close()
+        super(ParseXmlFileTestCase, self).tearDown()
+
+    def test_mmap_chunks(self):
+        utils.FEED_CHUNK_SIZE = 100
+        source = mmap.mmap(self.tmp_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.assertEqual(etree.tostring(parse_xml_file(source)), etree.tostring(generate_xml_root(self.xml)))
+        self.assertEqual(get_parse_stats(), {'parses': 2, 'recovered': 0})
+
+    def test_recovered(self):
+        self.tmp_file.seek(0)
+        self.tmp_file.truncate()
+        self.tmp_file.write('<form><a>x</form>')
+        self.tmp_file.flush()
+
+        source = mmap.mmap(self.tmp_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.assertEqual(parse_xml_file(source)[0].text, 'x')
+
+        self.tmp_file.seek(0)
+        self.assertEqual(parse_xml_file(self.tmp_file)[0].text, 'x')
+        self.assertEqual(get_parse_stats(), {'parses': 2, 'recovered': 2})
+
+        self.tmp_file.seek(0)
+        with self.assertRaises(etree.XMLSyntaxError):
+            parse_xml_file(self.tmp_file, PARSE_STRICT)
+
+
+class ParseIsoTestCase(unittest.TestCase):
+
+    def test_date(self):
+        self.assertEqual(parse_iso_date('2017-07-01'), date(2017, 7, 1))
+        self.assertEqual(parse_iso_date('2017-07-01Z'), date(2017, 7, 1))
+        self.assertEqual(parse_iso_date('2017-07-01+02:00'), date(2017, 7, 1))
+        # Not zero-padded, as accepted by strptime
+        self.assertEqual(parse_iso_date('2017-7-1'), date(2017, 7, 1))
+
+    def test_time(self):
+        self.assertEqual(parse_iso_time('17:48:03'), time(17, 48, 3))
+        self.assertEqual(parse_iso_time('17:48:03.25'), time(17, 48, 3, 250000))
+
+        value = parse_iso_time('17:48:03.1234567-05:30')
+        self.assertEqual(value.microsecond, 123456)
+        self.assertEqual(value.utcoffset(), timedelta(hours=-5, minutes=-30))
+
+    def test_datetime(self):
+        self.assertEqual(parse_iso_datetime('2017-07-01T17:48:03'), datetime(2017, 7, 1, 17, 48, 3))
+
+        value = parse_iso_datetime('2017-07-01T17:48:03.123Z')
+        self.assertEqual(value.microsecond, 123000)
+        self.assertEqual(value.utcoffset(), timedelta(0))
+        self.assertEqual(value.isoformat(), '2017-07-01T17:48:03.123000+00:00')
+
+        value = parse_iso_datetime('2017-07-01T17:48:03+02:00')
+        self.assertEqual(value, datetime(2017, 7, 1, 15, 48, 3, tzinfo=parse_iso_datetime('2017-07-01T00:00:00Z').tzinfo))
+
+    def test_invalid(self):
+        for text in ('2017-13-01', '2017-07-01T', 'foo', ''):
+            with self.assertRaises(ValueError):
+                parse_iso_date(text)
+
+        with self.assertRaises(ValueError):
+            parse_iso_time('25:00:00')
+
+        with self.assertRaises(ValueError):
+            parse_iso_datetime('2017-07-01 17:48:03')
+
+        # Timezone offsets out of range
+        for timezone in ('+99:00', '+02:75', '-14:01'):
+            with self.assertRaises(ValueError):
+                parse_iso_date('2017-07-01%s' % timezone)
+            with self.assertRaises(ValueError):
+                parse_iso_time('17:48:03%s' % timezone)
+            with self.assertRaises(ValueError):
+                parse_iso_datetime('2017-07-01T17:48:03%s' % timezone)
+        self.assertEqual(parse_iso_datetime('2017-07-01T17:48:03-14:00').utcoffset(), timedelta(hours=-14))
+
+        # A trailing newline
+        for parse, text in ((parse_iso_date, '2017-07-01\n'), (parse_iso_time, '17:48:03\n'),
+                            (parse_iso_datetime, '2017-07-01T17:48:03\n')):
+            with self.assertRaises(ValueError):
+                parse(text)
+
+    def test_memo(self):
+        value = parse_iso_date('2018-01-31')
+        self.assertIs(parse_iso_date('2018-01-31'), value)
+        self.assertIn('2018-01-31', parse_iso_date.cache)
+
+    def test_memo_bounded(self):
+        size = utils.ISO_CACHE_SIZE
+        try:
+            utils.ISO_CACHE_SIZE = 10
+            for day in range(1, 29):
+                parse_iso_date('2019-02-%02d' % day)
+            self.assertLessEqual(len(parse_iso_date.cache), 10)
+        finally:
+            utils.ISO_CACHE_SIZE = size
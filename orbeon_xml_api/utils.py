@@ -4,8 +4,70 @@
 
 from lxml import etree
 
+import hashlib
+import mmap
 import os
+import re
+import threading
 import unicodedata
+from collections import OrderedDict
+from copy import deepcopy
+from datetime import date, datetime, time, timedelta, tzinfo
+
+
+XML_NAMESPACE = 'http://www.w3.org/XML/1998/namespace'
+
+NAMESPACES = {
+    'xh': 'http://www.w3.org/1999/xhtml',
+    'xf': 'http://www.w3.org/2002/xforms',
+    # `xforms:` is an alternative prefix of the XForms namespace.
+    'xforms': 'http://www.w3.org/2002/xforms',
+    'fr': 'http://orbeon.org/oxf/xml/form-runner',
+}
+
+# Precompiled, namespace-aware queries. Prefixes are resolved by the
+# namespace (URI), not by a name() string comparison on every node.
+XPATH_BINDS = etree.XPath(
+    "//*[@id='fr-form-binds']//xf:bind", namespaces=NAMESPACES)
+XPATH_FR_BODY_ELEMENTS = etree.XPath(
+    "//fr:body//*[@bind]", namespaces=NAMESPACES)
+# Of all languages, see BuilderIndex.resources
+XPATH_RESOURCES = etree.XPath(
+    "//*[@id='fr-form-resources']/resources//resource[@xml:lang]")
+XPATH_FORM_INSTANCE = etree.XPath(
+    "//*[@id='fr-form-instance']/form")
+# Relative, so it also works on a (form) element of a larger document.
+XPATH_RUNNER_FORM_ELEMENTS = etree.XPath(
+    "descendant-or-self::form/*/*")
+XPATH_UNSANITIZED_ELEMENTS = etree.XPath(
+    '//*[contains(local-name(),"-") or contains(local-name(), ".")]')
+
+
+PARSE_STRICT = 'strict'
+PARSE_RECOVER = 'recover'
+PARSE_STRICT_THEN_RECOVER = 'strict-then-recover'
+
+# Bytes per feed() of an mmap to the parser.
+FEED_CHUNK_SIZE = 64 * 1024
+
+# ISO-8601 (XML Schema) values as emitted by Orbeon, with an optional
+# timezone and (time) fractional seconds.
+ISO_TIMEZONE = r'(Z|[+-]\d{2}:\d{2})?'
+# Anchored by \Z, because $ also matches before a trailing newline.
+ISO_DATE_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})%s\Z' % ISO_TIMEZONE)
+ISO_TIME_RE = re.compile(r'^(\d{2}):(\d{2}):(\d{2})(?:\.(\d+))?%s\Z' % ISO_TIMEZONE)
+ISO_DATETIME_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:\.(\d+))?%s\Z' % ISO_TIMEZONE)
+# Timezone offsets range from -14:00 to +14:00 (XML Schema).
+ISO_TIMEZONE_MAX_MINUTES = 14 * 60
+
+# Maximum number of parsed values memoized, per kind (date, time, dateTime).
+ISO_CACHE_SIZE = 4096
+
+# Reusable parsers, per thread.
+_parsers = threading.local()
+
+_parse_stats = {'parses': 0, 'recovered': 0}
+_parse_stats_lock = threading.Lock()
 
 
 def xml_from_file(path, filename):
@@ -13,27 +75,347 @@ def xml_from_file(path, filename):
     return etree.tostring(etree.parse("%s/%s/%s" % (cwd, path, filename)), encoding='UTF-8')
 
 
-def generate_xml_root(xml):
-    try:
-        parser = etree.XMLParser(
-            ns_clean=True,
-            recover=False,
-            encoding='utf-8',
-            remove_blank_text=True
-        )
-        root = etree.XML(xml, parser)
-    except etree.XMLSyntaxError:
-        parser = etree.XMLParser(
+def get_parser(recover=False):
+    """
+    Parser of the current thread, reused by every parse. (A parser can't be
+    shared by threads.)
+    """
+    parsers = getattr(_parsers, 'parsers', None)
+    if parsers is None:
+        parsers = _parsers.parsers = {}
+
+    if recover not in parsers:
+        parsers[recover] = etree.XMLParser(
             ns_clean=True,
-            recover=True,
+            recover=recover,
             encoding='utf-8',
             remove_blank_text=True
         )
-        root = etree.XML(xml, parser)
+    return parsers[recover]
+
+
+def generate_xml_root(xml, parse_policy=PARSE_STRICT_THEN_RECOVER):
+    """
+    @param parse_policy str
+        - strict: raise an XMLSyntaxError on malformed XML
+        - recover: parse whatever can be recovered
+        - strict-then-recover: as recover, but counted (see get_parse_stats)
+          when recovery was needed
+    """
+    # One (recovering) parse for strict-then-recover, instead of a strict
+    # parse which is redone on a syntax error. Well-formed XML parses the
+    # same either way.
+    parser = get_policy_parser(parse_policy)
+    root = etree.XML(xml, parser)
+
+    if parse_policy == PARSE_STRICT_THEN_RECOVER:
+        count_parse(recovered=bool(parser.error_log.filter_from_errors()))
+    return root
+
+
+def is_element(xml):
+    return isinstance(xml, (etree._Element, etree._ElementTree))
+
+
+def get_element_root(xml, copy=True):
+    """
+    @param xml _Element or _ElementTree
+    @param copy bool Copy the element, or else take ownership of it (it
+        shouldn't be changed elsewhere afterwards)
+    @return Element
+    """
+    if isinstance(xml, etree._ElementTree):
+        xml = xml.getroot()
+
+    if copy:
+        return deepcopy(xml)
+    else:
+        return xml
+
+
+def parse_xml_file(source, parse_policy=PARSE_STRICT_THEN_RECOVER):
+    """
+    Parse XML from a file, without reading it into a string first. lxml
+    reads a path or file object itself, an mmap is fed in chunks.
+
+    @param source str (path), file object or mmap
+    @param parse_policy str See generate_xml_root()
+    @return Element The root
+    """
+    parser = get_policy_parser(parse_policy)
 
+    if isinstance(source, mmap.mmap):
+        for offset in xrange(0, len(source), FEED_CHUNK_SIZE):
+            parser.feed(source[offset:offset + FEED_CHUNK_SIZE])
+        root = parser.close()
+        error_log = parser.feed_error_log
+    else:
+        root = etree.parse(source, parser).getroot()
+        error_log = parser.error_log
+
+    if parse_policy == PARSE_STRICT_THEN_RECOVER:
+        count_parse(recovered=bool(error_log.filter_from_errors()))
     return root
 
 
+def get_policy_parser(parse_policy):
+    if parse_policy == PARSE_STRICT:
+        return get_parser()
+    elif parse_policy in (PARSE_RECOVER, PARSE_STRICT_THEN_RECOVER):
+        return get_parser(recover=True)
+    else:
+        raise Exception("[orbeon-xml-api] Unknown parse policy: %s" % parse_policy)
+
+
+def count_parse(recovered=False):
+    with _parse_stats_lock:
+        _parse_stats['parses'] += 1
+        if recovered:
+            _parse_stats['recovered'] += 1
+
+
+def get_parse_stats():
+    """
+    Number of (strict-then-recover) parses, and how many of these needed
+    recovery from malformed XML.
+    """
+    with _parse_stats_lock:
+        return dict(_parse_stats)
+
+
+def reset_parse_stats():
+    with _parse_stats_lock:
+        _parse_stats['parses'] = 0
+        _parse_stats['recovered'] = 0
+
+
+def iterparse_form(source, names, parse_policy=PARSE_STRICT_THEN_RECOVER):
+    """
+    Stream (iterparse) the form instance out of a Runner XML document: the
+    form element, its sections and the controls by names. Any other element
+    is cleared (removed) once parsed, and parsing stops at the end of the
+    (first) form element.
+
+    @param source file object or filename
+    @param names set Control names (tags) to keep
+    @param parse_policy str See generate_xml_root(). A stream can't be
+        parsed twice, so strict-then-recover recovers as it goes.
+    @return Element The document root, holding (only) the form, or None
+    """
+    form = None
+    # Depth within the form element: 1 form, 2 section, 3 control.
+    depth = 0
+
+    context = etree.iterparse(source, events=('start', 'end'), remove_blank_text=True,
+                              recover=(parse_policy != PARSE_STRICT))
+
+    for event, el in context:
+        if event == 'start':
+            if depth:
+                depth += 1
+            elif el.tag == 'form':
+                form = el
+                depth = 1
+        elif depth:
+            if depth == 3 and unaccent_unicode(u"%s" % el.tag) not in names:
+                el.clear()
+                el.getparent().remove(el)
+
+            depth -= 1
+            if not depth:
+                break
+        else:
+            # Before the form, so not an ancestor of it.
+            el.clear()
+            while el.getprevious() is not None:
+                del el.getparent()[0]
+
+    if parse_policy == PARSE_STRICT_THEN_RECOVER:
+        count_parse(recovered=bool(context.error_log.filter_from_errors()))
+
+    if form is None:
+        return None
+
+    # Keep (only) the path from the document root to the form.
+    el = form
+    while el.getparent() is not None:
+        for sibling in list(el.itersiblings()) + list(el.itersiblings(preceding=True)):
+            el.getparent().remove(sibling)
+        el = el.getparent()
+
+    return el
+
+
+class FixedOffset(tzinfo):
+    """
+    Timezone by a fixed offset (in minutes) from UTC.
+    """
+
+    def __init__(self, minutes):
+        self.minutes = minutes
+
+    def utcoffset(self, dt):
+        return timedelta(minutes=self.minutes)
+
+    def dst(self, dt):
+        return timedelta(0)
+
+    def tzname(self, dt):
+        if self.minutes == 0:
+            return 'Z'
+        sign = '-' if self.minutes < 0 else '+'
+        return '%s%02d:%02d' % (sign, abs(self.minutes) // 60, abs(self.minutes) % 60)
+
+    def __reduce__(self):
+        return (FixedOffset, (self.minutes,))
+
+    def __repr__(self):
+        return 'FixedOffset(%s)' % self.minutes
+
+
+_timezones = {}
+
+
+def get_timezone(text):
+    """
+    @param text str Z or [+-]HH:MM (or None)
+    @return FixedOffset or None
+    @raise ValueError An offset out of range
+    """
+    if not text:
+        return None
+
+    if text not in _timezones:
+        if text == 'Z':
+            minutes = 0
+        else:
+            hours, minutes = int(text[1:3]), int(text[4:6])
+            if minutes >= 60 or hours * 60 + minutes > ISO_TIMEZONE_MAX_MINUTES:
+                raise ValueError("Timezone offset out of range: %s" % text)
+
+            minutes = hours * 60 + minutes
+            if text[0] == '-':
+                minutes = -minutes
+        _timezones[text] = FixedOffset(minutes)
+
+    return _timezones[text]
+
+
+def get_microseconds(text):
+    # Fractional seconds, truncated to microseconds.
+    if not text:
+        return 0
+    return int(text[:6].ljust(6, '0'))
+
+
+def memoize_iso(parse):
+    """
+    Memoize a parser of ISO-8601 values, bounded by ISO_CACHE_SIZE. The
+    (immutable) values cluster heavily, e.g. the dates of submissions.
+    """
+    cache = {}
+
+    def memoized(text):
+        try:
+            return cache[text]
+        except KeyError:
+            pass
+
+        value = parse(text)
+        if len(cache) >= ISO_CACHE_SIZE:
+            cache.clear()
+        cache[text] = value
+        return value
+
+    memoized.__name__ = parse.__name__
+    memoized.__doc__ = parse.__doc__
+    memoized.cache = cache
+    return memoized
+
+
+@memoize_iso
+def parse_iso_date(text):
+    """
+    Parse an xs:date, e.g. 2017-07-01 (a timezone is ignored).
+
+    @raise ValueError
+    """
+    match = ISO_DATE_RE.match(text)
+    if match is None:
+        return datetime.strptime(text, '%Y-%m-%d').date()
+
+    year, month, day, timezone = match.groups()
+    # Validated only.
+    get_timezone(timezone)
+    return date(int(year), int(month), int(day))
+
+
+@memoize_iso
+def parse_iso_time(text):
+    """
+    Parse an xs:time, e.g. 17:48:03, 17:48:03.250 or 17:48:03+02:00
+
+    @raise ValueError
+    """
+    match = ISO_TIME_RE.match(text)
+    if match is None:
+        return datetime.strptime(text, '%H:%M:%S').time()
+
+    hour, minute, second, fraction, timezone = match.groups()
+    return time(int(hour), int(minute), int(second), get_microseconds(fraction), get_timezone(timezone))
+
+
+@memoize_iso
+def parse_iso_datetime(text):
+    """
+    Parse an xs:dateTime, e.g. 2017-07-01T17:48:03, with optional
+    fractional seconds and timezone (then the datetime is aware).
+
+    @raise ValueError
+    """
+    match = ISO_DATETIME_RE.match(text)
+    if match is None:
+        return datetime.strptime(text, '%Y-%m-%dT%H:%M:%S')
+
+    year, month, day, hour, minute, second, fraction, timezone = match.groups()
+    return datetime(int(year), int(month), int(day), int(hour), int(minute), int(second),
+                    get_microseconds(fraction), get_timezone(timezone))
+
+
+def generate_content_key(xml, lang):
+    """
+    Content hash of a (Builder) XML document and language.
+    """
+    if isinstance(xml, unicode):
+        xml = xml.encode('utf-8')
+
+    sha = hashlib.sha1(xml)
+    sha.update((u'\0%s' % lang).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def get_attrs(obj):
+    """
+    Attributes (name => value) of an object, by its __slots__ and __dict__.
+    """
+    attrs = {}
+
+    for cls in type(obj).__mro__:
+        slots = cls.__dict__.get('__slots__', ())
+        if isinstance(slots, basestring):
+            slots = (slots,)
+
+        for name in slots:
+            try:
+                attrs[name] = object.__getattribute__(obj, name)
+            except AttributeError:
+                # Unset slot
+                pass
+
+    attrs.update(getattr(obj, '__dict__', {}))
+    return attrs
+
+
 def unaccent_unicode(unicode_str):
     return unicodedata.normalize('NFKD', unicode_str).encode('ASCII', 'ignore')
 
@@ -46,7 +428,7 @@ def sanitize_xml(xml_root):
 
     mapping = {}
 
-    for e in xml_root.xpath('//*[contains(local-name(),"-") or contains(local-name(), ".")]'):
+    for e in XPATH_UNSANITIZED_ELEMENTS(xml_root):
         old_tag = e.tag
 
         # replacements
@@ -88,3 +470,74 @@ def etree_to_dict(root):
             datadict[item.tag] = item.text
 
     return datadict
+
+
+def etree_to_xmltodict(element):
+    """
+    Convert an lxml element straight into the value xmltodict gives it, i.e.
+    xmltodict.parse(etree.tostring(element))[tag], without serializing and
+    re-parsing.
+
+    Attributes become '@name' keys, child elements (repeated ones a list)
+    are keyed by tag and (stripped) text is the value, or the '#text' key of
+    an element having attributes or children. Namespace declarations are
+    left out.
+    """
+    item = None
+
+    for key, value in element.attrib.items():
+        item = _push_xmltodict_data(item, u'@%s' % _qualified_name(element, key), value)
+
+    data = [element.text] if element.text else []
+
+    for child in element:
+        if isinstance(child.tag, basestring):
+            item = _push_xmltodict_data(item, _qualified_name(child, child.tag), etree_to_xmltodict(child))
+
+        # Comments are left out, but not the text following them.
+        if child.tail:
+            data.append(child.tail)
+
+    data = ''.join(data).strip() or None
+
+    if item is None:
+        return data
+    elif data:
+        item = _push_xmltodict_data(item, '#text', data)
+
+    return item
+
+
+def _push_xmltodict_data(item, key, data):
+    if item is None:
+        item = OrderedDict()
+
+    if key in item:
+        value = item[key]
+        if isinstance(value, list):
+            value.append(data)
+        else:
+            item[key] = [value, data]
+    else:
+        item[key] = data
+
+    return item
+
+
+def _qualified_name(element, name):
+    """
+    Prefixed (not Clark notation) name of the element tag or attribute.
+    """
+    if not name.startswith('{'):
+        return name
+
+    namespace, localname = name[1:].split('}', 1)
+
+    if namespace == XML_NAMESPACE:
+        return 'xml:%s' % localname
+
+    for prefix, uri in element.nsmap.items():
+        if uri == namespace and prefix is not None:
+            return '%s:%s' % (prefix, localname)
+
+    return localname
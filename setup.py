@@ -1,8 +1,16 @@
+import os
+import re
+
 from setuptools import setup
 
+# Single source: the package __version__ (importing the package requires
+# its dependencies).
+with open(os.path.join(os.path.dirname(__file__), 'orbeon_xml_api', '__init__.py')) as f:
+    version = re.search(r"^__version__ = '([^']+)'", f.read(), re.M).group(1)
+
 setup(
     name='orbeon-xml-api',
-    version='0.1.0.dev28',
+    version=version,
     description='A Python object API for Orbeon XML',
     url='https://github.com/bobslee/orbeon-xml-api',
     author='Bob Leers',
@@ -11,5 +19,8 @@ setup(
     packages=[
         'orbeon_xml_api'
     ],
-    install_requires=['lxml', 'xmltodict', 'xmlunittest']
+    install_requires=['lxml', 'xmltodict', 'xmlunittest'],
+    extras_require={
+        'numpy': ['numpy'],
+    }
 )